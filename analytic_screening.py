@@ -0,0 +1,239 @@
+import glob
+import numpy as np
+import pandas as pd
+
+from time import perf_counter
+from scipy.stats import skewnorm
+
+from bottleneck_determination import detect_itv_bottleneck, detect_apm_bottleneck, detect_bnw_bottleneck
+from scenario_canonicalization import get_process_times, get_result_file_path
+from factory_simulation_loop import BUFFER_CAPACITY
+
+##############################
+### Set up basic parameter ###
+
+# Default process time distribution of all machines (multiplier of the nominal process time)
+DEFAULT_DISTRIBUTION = skewnorm(a=10, loc=1)
+
+# Max. number of iterations and relative tolerance (on throughput) of the decomposition (lines with two
+# equal slowest stations converge slowly and are flagged as not converged, about 15% of random lines: their
+# throughput error is already below 0.2% after 100 iterations, but blocking and starvation can still shift
+# between the slowest stations, so they are always uncertain)
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-6
+
+# Arrows with a difference between blocking and starvation below this margin are undetermined, and candidates
+# with a severity within this margin of the highest one make a configuration uncertain
+UNCERTAINTY_MARGIN = 0.02
+
+# Observations before the system is swung in (excluded from the simulated shares)
+WARM_UP = 5000
+
+def get_variability(distribution=DEFAULT_DISTRIBUTION):
+    ''' Returns mean and squared coefficient of variation of a process time multiplier distribution
+    (frozen scipy distribution or Process_Time_Distribution).'''
+
+    # Get the exact distribution behind a lookup table
+    distribution = getattr(distribution, 'distribution', distribution)
+
+    # Return mean and squared coefficient of variation
+    return distribution.mean(), distribution.var() / distribution.mean()**2
+
+def evaluate_two_machine_line(mu_upstream, mu_downstream, capacity):
+    ''' Returns the probabilities of an empty and a full buffer and the throughput of a two-machine line
+    with exponential machines and the given (effective) number of places between both machines.'''
+
+    # Get ratio of both rates (the formulas are singular for equal rates)
+    ratio = mu_upstream / mu_downstream
+    equal = np.abs(ratio - 1) < 1e-9
+    ratio = np.where(equal, 0.5, ratio)
+
+    # Calculate probabilities of the birth-death process (geometric for unequal rates, uniform for equal rates)
+    p_empty = np.where(equal, 1 / (capacity+1), (1-ratio) / (1-ratio**(capacity+1)))
+    p_full = np.where(equal, 1 / (capacity+1), ratio**capacity * (1-ratio) / (1-ratio**(capacity+1)))
+
+    # Return probabilities and throughput of the downstream machine
+    return p_empty, p_full, mu_downstream * (1-p_empty)
+
+def estimate_line(process_times, buffer_capacity=BUFFER_CAPACITY, mean_multipliers=None, scvs=None):
+    ''' Estimates throughput, utilization, starvation and blocking of serial lines like Factory_Simulation
+    (infinite B0 and customer buffer) with a two-machine-line decomposition. Process times are given as
+    2D array (configuration x station), mean multipliers and squared coefficients of variation of the
+    process time distributions per station (default: skewnorm of the simulation). Configurations that
+    do not converge within MAX_ITERATIONS (mostly lines with several equal slowest stations) are marked in
+    'converged' and return the estimates of the last iteration.'''
+
+    # Get process times as 2D array
+    process_times = np.atleast_2d(np.asarray(process_times, dtype=float))
+    configuration_count, station_count = process_times.shape
+
+    # Get variability of the default distribution
+    default_mean, default_scv = get_variability()
+    mean_multipliers = np.broadcast_to(default_mean if mean_multipliers is None else mean_multipliers, process_times.shape)
+    scvs = np.broadcast_to(default_scv if scvs is None else scvs, process_times.shape)
+
+    # Calculate processing rates of all stations
+    mu = 1 / (process_times * mean_multipliers)
+
+    # Calculate effective capacity between two stations (buffer, part in the downstream machine and blocked
+    # part in the upstream machine), scaled for process time variability (exponential machines have scv 1)
+    capacity = (buffer_capacity + 2) * 2 / (scvs[:, :-1] + scvs[:, 1:])
+
+    # Set up rates of the upstream and downstream pseudo-machine of each two-machine line
+    mu_upstream = mu[:, :-1].copy()
+    mu_downstream = mu[:, 1:].copy()
+
+    # Evaluate all two-machine lines
+    p_empty, p_full, throughput = evaluate_two_machine_line(mu_upstream, mu_downstream, capacity)
+
+    # Iterate until the throughput of all two-machine lines is conserved
+    for iteration in range(MAX_ITERATIONS):
+        last_throughput = throughput.copy()
+
+        # Forward pass: pseudo-machine upstream of buffer i includes the starvation of station i
+        for i in range(1, station_count-1):
+            mu_upstream[:, i] = 1 / np.maximum(1/mu[:, i] + 1/throughput[:, i-1] - 1/mu_downstream[:, i-1], 1/mu[:, i])
+            p_empty[:, i], p_full[:, i], throughput[:, i] = evaluate_two_machine_line(mu_upstream[:, i], mu_downstream[:, i], capacity[:, i])
+
+        # Backward pass: pseudo-machine downstream of buffer i includes the blocking of station i+1
+        for i in range(station_count-3, -1, -1):
+            mu_downstream[:, i] = 1 / np.maximum(1/mu[:, i+1] + 1/throughput[:, i+1] - 1/mu_upstream[:, i+1], 1/mu[:, i+1])
+            p_empty[:, i], p_full[:, i], throughput[:, i] = evaluate_two_machine_line(mu_upstream[:, i], mu_downstream[:, i], capacity[:, i])
+
+        # Stop once converged
+        converged = np.max(np.abs(throughput / last_throughput - 1), axis=1) < TOLERANCE
+        if converged.all():
+            break
+
+    # Get throughput of the line
+    line_throughput = throughput.mean(axis=1)
+
+    # Return estimates per configuration and station (first station is never starved, last never blocked)
+    return {'throughput': line_throughput,
+            'utilization': line_throughput[:, None] / mu,
+            'starvation': np.concatenate([np.zeros((configuration_count, 1)), p_empty], axis=1),
+            'blocking': np.concatenate([p_full, np.zeros((configuration_count, 1))], axis=1),
+            'iterations': iteration + 1,
+            'converged': converged}
+
+def get_arrows(estimates, margin=UNCERTAINTY_MARGIN):
+    ''' Returns the direction of the arrow between each pair of neighbouring stations (configuration x buffer):
+    1 if the upstream station is blocked more often than the downstream station is starved (the bottleneck
+    is downstream), -1 for the opposite, and 0 if both are within the margin (undetermined).'''
+
+    # Compare blocking of the upstream station with starvation of the downstream station
+    difference = estimates['blocking'][:, :-1] - estimates['starvation'][:, 1:]
+
+    # Return arrow directions (undetermined within the margin)
+    return np.where(np.abs(difference) < margin, 0, np.sign(difference)).astype(np.int8)
+
+def screen_configurations(process_times, buffer_capacity=BUFFER_CAPACITY, margin=UNCERTAINTY_MARGIN, **variability):
+    ''' Predicts the bottleneck of each configuration from the estimated blocking and starvation with the 
+    arrow rule: a station is a bottleneck candidate if no arrow points away from it (the first station has 
+    no upstream arrow, the last no downstream arrow). The expected bottleneck is the candidate with the 
+    highest severity (sum of the blocking and starvation differences of its two arrows). Configurations with 
+    several candidates within the margin of the highest severity, or without converged decomposition, are 
+    uncertain and should be simulated.'''
+
+    # Estimate all configurations
+    estimates = estimate_line(process_times, buffer_capacity, **variability)
+    configuration_count = len(estimates['throughput'])
+
+    # Get arrows and differences between blocking of the upstream and starvation of the downstream station
+    arrows = get_arrows(estimates, margin)
+    difference = estimates['blocking'][:, :-1] - estimates['starvation'][:, 1:]
+
+    # Pad arrows and differences, so every station has an upstream and a downstream arrow (pointing into the line ends)
+    upstream_arrows = np.concatenate([np.ones((configuration_count, 1), dtype=np.int8), arrows], axis=1)
+    downstream_arrows = np.concatenate([arrows, -np.ones((configuration_count, 1), dtype=np.int8)], axis=1)
+    upstream_difference = np.concatenate([np.zeros((configuration_count, 1)), difference], axis=1)
+    downstream_difference = np.concatenate([difference, np.zeros((configuration_count, 1))], axis=1)
+
+    # Get candidates (no arrow points away) and their severity
+    estimates['candidates'] = (upstream_arrows >= 0) & (downstream_arrows <= 0)
+    severity = np.where(estimates['candidates'], np.abs(upstream_difference) + np.abs(downstream_difference), -np.inf)
+    estimates['severity'] = severity
+
+    # Get expected bottleneck (station number) and flag uncertain configurations
+    estimates['bottleneck'] = np.argmax(severity, axis=1) + 1
+    estimates['uncertain'] = ((severity >= severity.max(axis=1, keepdims=True) - margin).sum(axis=1) > 1) | ~estimates['converged']
+
+    # Return estimates
+    return estimates
+
+def cross_check(results_dir='.', margin=UNCERTAINTY_MARGIN):
+    ''' Compares the screening with the simulated results in all results_bn-pt_* directories. Returns one
+    row per scenario with predicted and simulated throughput, the share of arrows that point in the same 
+    direction as the arrows from the simulated blocking and starvation shares (of all determined arrows), 
+    and whether the expected bottleneck is the station detected most often by each method.'''
+
+    # Set up column names of the result csvs
+    station_count = 7
+    column_names = (['bl_b{i}'.format(i=i) for i in range(station_count+1)] + ['ms_m{i}'.format(i=i+1) for i in range(station_count)]
+                    + ['pt_m{i}'.format(i=i+1) for i in range(station_count)])
+
+    # Set up list of compared scenarios
+    rows = []
+
+    # Loop over all scenarios with simulated results
+    for bn_pt in range(11, 21, 1):
+        for m in range(1,6):
+            for n in range(m,6): # (n, m) has the same results as (m, n)
+
+                # Skip scenarios without results
+                file_path = glob.glob(results_dir + '/' + get_result_file_path(bn_pt, m, n))
+                if not file_path:
+                    continue
+
+                # Load data
+                data = pd.read_csv(file_path[0], names=column_names).reset_index(drop=True)
+
+                # Detect bottlenecks with all methods (after the system is swung in)
+                bottlenecks = {'itv': detect_itv_bottleneck(data[column_names[2*station_count+1:]].to_numpy(), 5000)[WARM_UP:],
+                               'apm': detect_apm_bottleneck(data[column_names[station_count+1:2*station_count+1]].to_numpy())[WARM_UP:],
+                               'bnw': detect_bnw_bottleneck(data[column_names[:station_count+1]].to_numpy(), BUFFER_CAPACITY)[WARM_UP:]}
+
+                # Screen the scenario
+                estimates = screen_configurations(get_process_times(m, n, bn_pt), margin=margin)
+
+                # Get simulated throughput from the customer buffer
+                simulated_throughput = (data['bl_b7'].iloc[-1] - data['bl_b7'].iloc[WARM_UP]) / (len(data) - WARM_UP - 1)
+
+                # Get simulated arrows from the shares of blocked and starved observations
+                machine_states = data[column_names[station_count+1:2*station_count+1]].to_numpy()[WARM_UP:]
+                simulated_arrows = get_arrows({'blocking': (machine_states == 2).mean(axis=0, keepdims=True),
+                                               'starvation': (machine_states == 1).mean(axis=0, keepdims=True)}, margin)
+
+                # Compare determined arrows and the expected bottleneck with the station detected most often by each method
+                arrows = get_arrows(estimates, margin)[0]
+                row = {'bn_pt': bn_pt, 'm': m, 'n': n,
+                       'throughput': estimates['throughput'][0], 'simulated_throughput': simulated_throughput,
+                       'arrows': ''.join('>' if arrow > 0 else '<' if arrow < 0 else '-' for arrow in arrows),
+                       'simulated_arrows': ''.join('>' if arrow > 0 else '<' if arrow < 0 else '-' for arrow in simulated_arrows[0]),
+                       'arrow_agreement': (arrows == simulated_arrows[0])[arrows != 0].mean(),
+                       'bottleneck': estimates['bottleneck'][0], 'uncertain': estimates['uncertain'][0]}
+                for method, bottleneck in bottlenecks.items():
+                    row['simulated_' + method] = np.argmax(np.bincount(bottleneck, minlength=station_count+1))
+                    row['agrees_' + method] = row['simulated_' + method] == row['bottleneck']
+                rows += [row]
+
+    # Return comparison
+    return pd.DataFrame(rows)
+
+if __name__ == '__main__':
+
+    # Measure the screening of many random configurations (process times from 10 to 20 on every station)
+    configurations = np.random.randint(10, 21, size=(300, 7))
+    start = perf_counter()
+    estimates = screen_configurations(configurations)
+    print('Screened {} configurations in {:.1f} ms ({} iterations, {} not converged), {} uncertain'.format(
+        len(configurations), (perf_counter() - start)*1000, estimates['iterations'], (~estimates['converged']).sum(), estimates['uncertain'].sum()))
+
+    # Cross-check with the simulated results
+    df_check = cross_check()
+    print(df_check.to_string())
+    print('Mean relative throughput error: {:.2%}'.format((df_check['throughput'] / df_check['simulated_throughput'] - 1).abs().mean()))
+    print('Determined arrows in the simulated direction: {:.0%}'.format(df_check['arrow_agreement'].mean()))
+    for method in ['itv', 'apm', 'bnw']:
+        print('Expected bottleneck detected most often by {}: {:.0%} of certain, {:.0%} of uncertain configurations'.format(method,
+            df_check[~df_check['uncertain']]['agrees_' + method].mean(), df_check[df_check['uncertain']]['agrees_' + method].mean()))
@@ -3,23 +3,24 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.stats import skewnorm
+from streaming_histogram import stream_histogram
 
 # Set up standard values for both distributions 
 maxValue = 1
 skewness = 10 # Negative values are left skewed, positive values are right skewed.
-sample_size = 10**6 # used **8 for the paper (computation...)
+sample_size = 10**8 # samples are streamed in chunks, so memory stays constant
+processes = 1 # more processes only from a script with a __main__ guard (spawned workers re-run this script otherwise)
 
-# Set up two sample sets for distribution plot 
-data_10 = skewnorm.rvs(a=skewness, loc=1, size=sample_size) * 10 # Skewnorm function
-data_12 = skewnorm.rvs(a=skewness, loc=1, size=sample_size) * 12 # Skewnorm function
+# Set up fixed bin edges for both histograms (covers the plotted range)
+bin_edges = np.linspace(0, 60, 1501)
 
-# Get occurence and value via histogram
-occ_10, x_10, _ = plt.hist(data_10, bins=1000, histtype=u'step')
-occ_12, x_12, _ = plt.hist(data_12, bins=1000, histtype=u'step')
+# Get occurence and mean via streaming histogram
+occ_10, mean_10 = stream_histogram(skewnorm(a=skewness, loc=1), 10, sample_size, bin_edges, processes=processes, seed=10)
+occ_12, mean_12 = stream_histogram(skewnorm(a=skewness, loc=1), 12, sample_size, bin_edges, processes=processes, seed=12)
 
 # Get centers of histogram bars
-smooth_10 = 0.5*(x_10[1:] + x_10[:-1])
-smooth_12 = 0.5*(x_12[1:] + x_12[:-1])
+smooth_10 = 0.5*(bin_edges[1:] + bin_edges[:-1])
+smooth_12 = 0.5*(bin_edges[1:] + bin_edges[:-1])
 
 # Define max limit for all y values in plot 
 y_max = max(occ_10.max(), occ_12.max())
@@ -32,11 +33,11 @@ plt.ylim(0, (y_max/sample_size)*1.05)
 
 # Plot distribution and process time mean
 plt.plot(smooth_10, occ_10/sample_size, color='forestgreen', label='Non-bottleneck') # using bin centers instead of edges
-plt.vlines(data_10.mean(), 0, y_max*1.02, linestyles='--', linewidth=0.5, color='forestgreen', label='Non-bottleneck (mean)')
+plt.vlines(mean_10, 0, y_max*1.02, linestyles='--', linewidth=0.5, color='forestgreen', label='Non-bottleneck (mean)')
 
 # Plot distribution and process time mean 
 plt.plot(smooth_12, occ_12/sample_size, color='firebrick', label='Bottleneck (with +20%)') 
-plt.vlines(data_12.mean(), 0, y_max*1.02, linestyles='--', linewidth=0.5, color='firebrick', label='Bottleneck (mean)')
+plt.vlines(mean_12, 0, y_max*1.02, linestyles='--', linewidth=0.5, color='firebrick', label='Bottleneck (mean)')
 
 # Set plot title
 plt.title('Right-skewed distribution of process times')
@@ -50,8 +51,8 @@ plt.legend()
 plt.tight_layout()
 plt.show()
 
-print('mean 10: ' + str(data_10.mean()))
-print('mean 12: ' + str(data_12.mean()))
+print('mean 10: ' + str(mean_10))
+print('mean 12: ' + str(mean_12))
 
 #%% Plot one example of the later matrix plot (FIGURE 5)
 
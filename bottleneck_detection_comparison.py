@@ -1,8 +1,12 @@
 #%%
+import numpy as np
 import pandas as pd 
 import matplotlib.pyplot as plt
 
-from bottleneck_determination import calculate_itv_bottleneck, calculate_apm_bottleneck, calculate_bnw_bottleneck
+from bottleneck_determination import calculate_agreement_ratios
+from result_stack import get_result_stack, detect_stack_bottlenecks
+from scenario_canonicalization import get_unique_scenarios
+from factory_simulation_loop import SEED, ENGINE_PARAMETERS
 
 # Set total number of stations for import 
 station_count = 7
@@ -19,74 +23,34 @@ column_names = buffer_level_cols + machine_state_cols + process_times_cols
 bottleneck_type = ['bnw', 'apm', 'itv']
 bottleneck_name = ['Bottleneck Walk (BNW)', 'Active Period Method (APM)', 'Interdeparture Time Variance (ITV)']
 
-# Set up list pairs of all three possible combinations of bottleneck detection methods 
+# Set up list pairs of all three possible combinations of bottleneck detection methods (numbers index the detected bottlenecks ordered itv, apm, bnw)
 combination_methods = [['bnw', 'apm'], ['apm', 'itv'], ['itv', 'bnw']]
 combination_numbers = [[0, 1], [1, 2], [2, 0]]
 
-# Create result DataFrame for comparison
-cols = ['bn_pt', 'm', 'n', 'method_1', 'method_2' ]
-df_comp = pd.DataFrame(columns=cols)
+# Get all unique scenarios, since (m, n) and (n, m) share the same simulation (first alias is simulated)
+unique_scenarios = list(get_unique_scenarios(range(11, 21, 1), range(1, 6), SEED, **ENGINE_PARAMETERS).values())
 
-# Loop all bottleneck process times
-for bn_pt in range(11, 21, 1): # not for calculations, just used to loop files
+# Open the typed result stack if it covers all unique scenarios, else stack the result csvs (raises if a result csv is missing)
+stack, stacked_scenarios = get_result_stack([aliases[0] for aliases in unique_scenarios])
 
-    # Print current bottleneck type
-    if True: 
-        print('Bottleneck process time: ' + str(bn_pt))
+# Calculate the bottleneck stations of all scenarios with all three detection methods (scenario x time x method, ordered itv, apm, bnw)
+bottlenecks = detect_stack_bottlenecks(stack, variance_intervall=5000, buffer_capacity=5)
 
-    # Loop over all buffer-bottleneck-combinations
-    for m in range(1,6):
-        for n in range(1,6):
+# Calculate ratio of agreement for the three possible combinations of all scenarios (scenario x combination)
+ratios = calculate_agreement_ratios(bottlenecks, combination_numbers)
 
-            # Get file path as string for import
-            file_path = 'results_bn-pt_{bn_pt}/result_25k_bn({bn1},{bn2})_bn-pt({bn_pt}).csv'.format(bn1=m, bn2=n, bn_pt=bn_pt)
+# Get stack index of every (bn_pt, m, n) in loop order, resolving aliases to their simulated scenario
+stack_index = {scenario: index for index, scenario in enumerate(stacked_scenarios)}
+alias_index = {alias: stack_index[aliases[0]] for aliases in unique_scenarios for alias in aliases}
+scenarios = [(bn_pt, m, n) for bn_pt in range(11, 21, 1) for m in range(1,6) for n in range(1,6)]
 
-            # Load data 
-            data = pd.read_csv(file_path, names=column_names).reset_index(drop=True)
-
-            # Calculate the bottleneck stations with all three detection methods
-            data = calculate_itv_bottleneck(df=data, 
-                                            station_count=station_count, 
-                                            variance_intervall=5000, 
-                                            append_aux_variables=False)
-            data = calculate_apm_bottleneck(df=data, 
-                                            station_count=station_count, 
-                                            append_aux_variables=False)
-            data = calculate_bnw_bottleneck(df=data, 
-                                            station_count=station_count, 
-                                            buffer_capacity=5)
-
-            # Limit data to only bottleneck columns for comparison
-            data = data[data.columns[-3:]]
-
-            # Loop over the three possible combinations and append comparison dict
-            for methods, numbers in zip(combination_methods, combination_numbers): 
-
-                # Unpack ziped pairs to variables
-                met1 = methods[0]
-                met2 = methods[1]
-                num1 = numbers[0]
-                num2 = numbers[1]
-
-                # Create result dict from cols 
-                vals = dict.fromkeys(cols)
-                # Current process time
-                vals['bn_pt'] = bn_pt
-                # Station number of current bottleneck stations
-                vals['m'] = m
-                vals['n'] = n
-                # Name of compared detection method
-                vals['method_1'] = met1
-                vals['method_2'] = met2
-
-                # Check for agreement on detected bottleneck stations
-                comp = data[data.columns[num1]] == data[data.columns[num2]]
-                # Calculate ratio of agreement and add it to the dict
-
-                vals ['ratio'] = sum(comp)/len(comp)
-
-                # Add dict to result dataframe
-                df_comp = df_comp.append(vals, ignore_index=True)
+# Create result DataFrame for comparison (one row per scenario and combination)
+df_comp = pd.DataFrame({'bn_pt': np.repeat([scenario[0] for scenario in scenarios], len(combination_methods)), 
+                        'm': np.repeat([scenario[1] for scenario in scenarios], len(combination_methods)), 
+                        'n': np.repeat([scenario[2] for scenario in scenarios], len(combination_methods)), 
+                        'method_1': [methods[0] for methods in combination_methods] * len(scenarios), 
+                        'method_2': [methods[1] for methods in combination_methods] * len(scenarios), 
+                        'ratio': ratios[[alias_index[scenario] for scenario in scenarios]].ravel()})
 
 # Group and calcuate average ratios (TABLE 1)
 df_comp.groupby(['bn_pt', 'method_1', 'method_2'])['ratio'].mean().reset_index()
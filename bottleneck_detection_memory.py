@@ -0,0 +1,65 @@
+#%% Measure peak memory of the original DataFrame detectors, the DataFrame wrappers and the array detectors
+
+import warnings
+import tracemalloc
+import pandas as pd
+
+import bottleneck_determination_baseline as baseline
+from bottleneck_determination import calculate_itv_bottleneck, calculate_apm_bottleneck, calculate_bnw_bottleneck
+from bottleneck_determination import detect_itv_bottleneck, detect_apm_bottleneck, detect_bnw_bottleneck, get_column_views
+
+# Set total number of stations for import 
+station_count = 7
+
+# Set column names for all buffer level, machine states and process times
+buffer_level_cols = ['bl_b{i}'.format(i=i) for i in range(station_count+1)] 
+machine_state_cols = ['ms_m{i}'.format(i=i+1) for i in range(station_count)]
+process_times_cols = ['pt_m{i}'.format(i=i+1) for i in range(station_count)]
+
+# Column names for import
+column_names = buffer_level_cols + machine_state_cols + process_times_cols
+
+# Load one example scenario (25k rows)
+data_25k = pd.read_csv('results_bn-pt_12/result_25k_bn(2,5)_bn-pt(12).csv', names=column_names).reset_index(drop=True)
+
+# Repeat the example to 1M rows
+data_1m = pd.concat([data_25k] * 40, ignore_index=True)
+
+def detect_with_baseline(data):
+    ''' Chains the original DataFrame detectors like the original comparison script (before).'''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data = baseline.calculate_itv_bottleneck(df=data, station_count=station_count, variance_intervall=5000, append_aux_variables=False)
+        data = baseline.calculate_apm_bottleneck(df=data, station_count=station_count, append_aux_variables=False)
+        data = baseline.calculate_bnw_bottleneck(df=data, station_count=station_count, buffer_capacity=5)
+    return data[data.columns[-3:]]
+
+def detect_with_dataframes(data):
+    ''' Chains the DataFrame detectors (now wrappers of the array detectors) like the comparison script.'''
+    data = calculate_itv_bottleneck(df=data, station_count=station_count, variance_intervall=5000, append_aux_variables=False)
+    data = calculate_apm_bottleneck(df=data, station_count=station_count, append_aux_variables=False)
+    data = calculate_bnw_bottleneck(df=data, station_count=station_count, buffer_capacity=5)
+    return data[data.columns[-3:]]
+
+def detect_with_arrays(data):
+    ''' Calls the array detectors on views of the required columns only.'''
+    return (detect_itv_bottleneck(get_column_views(data, 2*station_count+1, 3*station_count+1), variance_intervall=5000), 
+            detect_apm_bottleneck(get_column_views(data, station_count+1, 2*station_count+1)), 
+            detect_bnw_bottleneck(get_column_views(data, 0, station_count+1), buffer_capacity=5))
+
+def measure_peak_memory(function, data):
+    ''' Returns the peak memory (in MB) allocated while running the function on the data.'''
+    tracemalloc.start()
+    function(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 10**6
+
+# Measure and print peak memory for both input sizes (the original detectors loop over all rows in python,
+# so the 1M rows take several minutes)
+for name, data in [('25k', data_25k), ('1M', data_1m)]:
+    peak_baseline = measure_peak_memory(detect_with_baseline, data)
+    peak_dataframes = measure_peak_memory(detect_with_dataframes, data)
+    peak_arrays = measure_peak_memory(detect_with_arrays, data)
+    print('{:>3} rows (input {:.1f} MB): original DataFrame detectors {:.1f} MB, DataFrame wrappers {:.1f} MB, array detectors {:.1f} MB peak'.format(
+        name, data.memory_usage().sum() / 10**6, peak_baseline, peak_dataframes, peak_arrays))
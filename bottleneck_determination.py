@@ -1,144 +1,283 @@
+import numpy as np
 import pandas as pd
 
-from numpy.core.numeric import NaN
-from pandas.io.formats.format import DataFrameFormatter
+# Get columns of arrays or data frames without copying
+def get_columns(values):
+    ''' Returns a list of column arrays (the last axis) for a 2D array (time x column), a 3D array (scenario x
+    time x column) or a list of column arrays.'''
+    if isinstance(values, np.ndarray):
+        return [values[..., column] for column in range(values.shape[-1])]
+    return list(values)
 
-pd.options.mode.chained_assignment = None # for convenience
+def get_column_views(df, start, stop):
+    ''' Returns the columns start to stop of a data frame as list of 1D arrays (views, not a copied frame).'''
+    return [df.iloc[:, column].to_numpy() for column in range(start, stop)]
+
+# Get compact departure events from the per-tick grid
+def get_departure_events(interdeparture_times):
+    ''' Returns the departure events (tick, interdeparture time) of each machine from the interdeparture 
+    times as 2D array (time x machine) or list of column arrays that are NaN without departure.'''
 
-# Calculate bottleneck according to Interdeparture Time Variance
-def calculate_itv_bottleneck(df, station_count, variance_intervall, append_aux_variables):
-    ''' Returns one new column per station with the interdeparture times variances, and a new attribute 
-    "bottleneck_itv" that gives the station number of the current interdeparture time bottleneck. '''
+    # Set up list of departure events
+    departure_events = []
+
+    # Loop over all machines
+    for times in get_columns(interdeparture_times):
+
+        # Get ticks with a departure and their interdeparture times
+        departure_ticks = np.flatnonzero(~np.isnan(times))
+        departure_events += [(departure_ticks, times[departure_ticks])]
+
+    # Return all departure events
+    return departure_events
+
+def get_itv_change_ticks(departure_events, variance_intervall):
+    ''' Returns all ticks at which a rolling interdeparture time variance can change (a departure enters or 
+    leaves the window), so the ITV bottleneck is constant between two consecutive change ticks.'''
+    return np.unique(np.concatenate([np.concatenate([ticks, ticks + variance_intervall]) for ticks, _ in departure_events]))
+
+def expand_to_ticks(change_ticks, values, ticks):
+    ''' Returns the values at the given ticks (array of any shape) of a piecewise constant series that is 
+    given at its change ticks (0 before the first change tick).'''
+
+    # Return zeros without any change
+    if len(change_ticks) == 0:
+        return np.zeros(np.shape(ticks), dtype=values.dtype)
+
+    # Get last change tick at or before each tick
+    last_change = np.searchsorted(change_ticks, ticks, side='right') - 1
 
-    # Create a supporting df containing only the interdeparture times
-    df_itv = df[df.columns[2*station_count+1:]]
+    # Return value of the last change (0 before the first change)
+    return np.where(last_change >= 0, values[np.maximum(last_change, 0)], 0).astype(values.dtype)
+
+# Calculate rolling interdeparture time variance on departure events
+def calculate_event_itv(departure_ticks, interdeparture_times, variance_intervall, ticks):
+    ''' Returns the sample variance of all interdeparture times with a departure tick within the window 
+    (t - variance_intervall, t] for each of the given ticks (NaN with less than two departures).'''
+
+    # Shift all values by their mean for numerically stable sums
+    shifted_times = interdeparture_times - (interdeparture_times.mean() if len(interdeparture_times) else 0)
+
+    # Calculate prefix sums of all departures (with leading zero)
+    prefix_sums = np.concatenate([[0], np.cumsum(shifted_times)])
+    prefix_square_sums = np.concatenate([[0], np.cumsum(shifted_times**2)])
+
+    # Get first and last departure of each window
+    window_start = np.searchsorted(departure_ticks, ticks - variance_intervall, side='right')
+    window_end = np.searchsorted(departure_ticks, ticks, side='right')
+
+    # Calculate count, sum and sum of squares of each window
+    count = window_end - window_start
+    sums = prefix_sums[window_end] - prefix_sums[window_start]
+    square_sums = prefix_square_sums[window_end] - prefix_square_sums[window_start]
+
+    # Calculate sample variance of each window (requires at least two values, like min_periods=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count >= 2, np.maximum(square_sums - sums**2/count, 0) / (count-1), np.nan)
+
+# Calculate bottleneck according to Interdeparture Time Variance (on departure events)
+def detect_itv_bottleneck_from_events(departure_events, variance_intervall, ticks, return_aux=False):
+    ''' Returns the machine number (int8) with the lowest rolling interdeparture time variance for each of 
+    the given ticks (0 if no variance is available yet). The departure events are expected as list of 
+    (departure ticks, interdeparture times) per machine. With return_aux, the variances are returned as well.'''
+
+    # Set up lowest variance and bottleneck of each tick
+    lowest_itv = np.full(len(ticks), np.inf)
+    bottleneck_itv = np.zeros(len(ticks), dtype=np.int8)
+
+    # Set up variances of all machines (only if requested)
+    if return_aux:
+        itv = np.empty((len(ticks), len(departure_events)))
+
+    # Loop over all machines
+    for machine, (departure_ticks, interdeparture_times) in enumerate(departure_events):
+
+        # Calculate rolling variance at all ticks
+        machine_itv = calculate_event_itv(departure_ticks, interdeparture_times, variance_intervall, ticks)
 
-    # Calculate interdeparture time variances with rolling window
-    df_itv = df_itv.rolling(variance_intervall, axis=0, min_periods=2).var(skipna=True)
+        # Keep machine with lowest variance (first one on ties, NaN is never lower)
+        lower = machine_itv < lowest_itv
+        lowest_itv[lower] = machine_itv[lower]
+        bottleneck_itv[lower] = machine + 1
+
+        # Keep variances if requested
+        if return_aux:
+            itv[:, machine] = machine_itv
+
+    # Return bottlenecks (and variances)
+    return (bottleneck_itv, itv) if return_aux else bottleneck_itv
 
-    # Rename columns to itv_m
-    df_itv.columns = ['itv_m{}'.format(i) for i in range(1, station_count+1)]
+# Calculate bottleneck according to Interdeparture Time Variance (on arrays)
+def detect_itv_bottleneck(interdeparture_times, variance_intervall, return_aux=False):
+    ''' Returns the machine number (int8) with the lowest rolling interdeparture time variance for each 
+    observation (0 if no variance is available yet). The interdeparture times are expected as 2D array 
+    (time x machine) or list of column arrays that are NaN without departure. With return_aux, the rolling 
+    variances are returned as well.'''
 
-    # Create new column with machine name with lowest ITV
-    df_itv['bottleneck_itv'] = df_itv.idxmin(axis=1)
+    # Get compact departure events of all machines
+    departure_events = get_departure_events(interdeparture_times)
+    ticks = np.arange(len(get_columns(interdeparture_times)[0]))
 
-    # Substitute NaN bottlenecks for zero
-    df_itv['bottleneck_itv'] = ['itv_m0' if pd.isna(bn) else bn for bn in df_itv['bottleneck_itv']]
+    # Detect bottlenecks and variances at every observation
+    if return_aux:
+        return detect_itv_bottleneck_from_events(departure_events, variance_intervall, ticks, return_aux)
 
-    # Convert bottleneck column to int for easy plotting
-    df_itv['bottleneck_itv'] = [int(bn[5:]) for bn in df_itv['bottleneck_itv']]
+    # Detect bottlenecks only at the ticks where a variance can change and expand them to every observation
+    change_ticks = get_itv_change_ticks(departure_events, variance_intervall)
+    change_ticks = change_ticks[change_ticks < len(ticks)]
+    return expand_to_ticks(change_ticks, detect_itv_bottleneck_from_events(departure_events, variance_intervall, change_ticks), ticks)
 
-    # Append new columns to dataframe 
+# Calculate bottleneck according to Interdeparture Time Variance (on stacked arrays)
+def detect_itv_bottleneck_batch(interdeparture_times, variance_intervall):
+    ''' Returns the machine number (int8) with the lowest rolling interdeparture time variance for each 
+    scenario and observation (0 if no variance is available yet). The interdeparture times are expected as 
+    3D array (scenario x time x machine) that is NaN without departure. The departure events of all 
+    scenarios are placed on one tick axis with a gap of one window between two scenarios, so all scenarios 
+    are detected with a single call of the event detection (only at the ticks where a variance can change).'''
+
+    # Get number of scenarios and observations
+    scenario_count, tick_count, _ = interdeparture_times.shape
+
+    # Get offset of each scenario on the common tick axis (no window spans two scenarios)
+    offsets = np.arange(scenario_count) * (tick_count + variance_intervall)
+
+    # Set up list of departure events
+    departure_events = []
+
+    # Loop over all machines
+    for times in get_columns(interdeparture_times):
+
+        # Get scenario, tick and interdeparture time of all departures
+        scenarios, departure_ticks = np.nonzero(~np.isnan(times))
+        departure_times = times[scenarios, departure_ticks]
+
+        # Shift all values by the mean of their scenario (like the event detection does per scenario)
+        departure_count = np.bincount(scenarios, minlength=scenario_count)
+        mean_times = np.bincount(scenarios, weights=departure_times, minlength=scenario_count) / np.maximum(departure_count, 1)
+        departure_events += [(offsets[scenarios] + departure_ticks, departure_times - mean_times[scenarios])]
+
+    # Detect bottlenecks at all change ticks (all windows are empty at the last change tick of each gap)
+    change_ticks = get_itv_change_ticks(departure_events, variance_intervall)
+    bottleneck_itv = detect_itv_bottleneck_from_events(departure_events, variance_intervall, change_ticks)
+
+    # Expand bottlenecks to all observations of all scenarios
+    return expand_to_ticks(change_ticks, bottleneck_itv, offsets[:, None] + np.arange(tick_count))
+
+# Calculate bottleneck according to Active Period Method (on arrays)
+def detect_apm_bottleneck(machine_states, return_aux=False):
+    ''' Returns the machine number (int8) with the longest current active period for each observation. 
+    The machine states are expected as 2D array (time x machine), 3D array (scenario x time x machine) or 
+    list of column arrays with 0 for active machines. With return_aux, the active period lengths are 
+    returned as well.'''
+
+    # Get machine states of all machines as columns
+    columns = get_columns(machine_states)
+
+    # Get observation number of each row
+    observation = np.arange(columns[0].shape[-1], dtype=np.int32)
+
+    # Set up longest active period and bottleneck of each observation (of each scenario)
+    longest_active_period = np.full(columns[0].shape, -1, dtype=np.int32)
+    bottleneck_apm = np.zeros(columns[0].shape, dtype=np.int8)
+
+    # Set up active period lengths of all machines (only if requested)
+    if return_aux:
+        active_period_lengths = np.empty(columns[0].shape + (len(columns),), dtype=np.int32)
+
+    # Loop over all machines
+    for machine, states in enumerate(columns):
+
+        # Get last observation the machine was not active (-1 if it was active since the start)
+        last_inactive = np.maximum.accumulate(np.where(states == 0, np.int32(-1), observation), axis=-1)
+
+        # Calculate active period lengths (zero for machines that are not active)
+        machine_active_period_lengths = observation - last_inactive
+
+        # Keep machine with longest active period (first one on ties)
+        longer = machine_active_period_lengths > longest_active_period
+        longest_active_period[longer] = machine_active_period_lengths[longer]
+        bottleneck_apm[longer] = machine + 1
+
+        # Keep active period lengths if requested
+        if return_aux:
+            active_period_lengths[..., machine] = machine_active_period_lengths
+
+    # Return bottlenecks (and active period lengths)
+    return (bottleneck_apm, active_period_lengths) if return_aux else bottleneck_apm
+
+# Calculate bottleneck according to Arrow Method (on arrays)
+def detect_bnw_bottleneck(buffer_levels, buffer_capacity):
+    ''' Returns the machine number (int8) of the current bottleneck according to the bottleneck walk for 
+    each observation. The buffer levels are expected as 2D array (time x buffer), 3D array (scenario x time x 
+    buffer) or list of column arrays including B0.'''
+
+    # Get buffer levels of all buffers as columns
+    columns = get_columns(buffer_levels)
+
+    # Get number of stations (one buffer less than the buffer levels including B0)
+    station_count = len(columns) - 1
+
+    # Calculate lower bottleneck limit
+    bnw_lower_limit = round(buffer_capacity*(1/3), ndigits=0) # 2
+
+    # Use last station as default ('customer bottleneck')
+    bottleneck_bnw = np.full(columns[0].shape, station_count, dtype=np.int8)
+
+    # Walk the buffers backwards, so the first turning arrow is assigned last (B0 is infinite)
+    for buffer_number in range(station_count, 0, -1):
+
+        # Turning of the arrow, indicated by a buffer level lower than the lower-limit
+        bottleneck_bnw[columns[buffer_number] < bnw_lower_limit] = buffer_number
+
+    # Return bottlenecks
+    return bottleneck_bnw
+
+# Compare bottlenecks of two detection methods
+def calculate_agreement_ratios(bottlenecks, combination_numbers):
+    ''' Returns the ratio of observations on which both methods of each pair agree for every scenario 
+    (scenario x pair). The bottlenecks are expected as 3D array (scenario x time x method) and the pairs 
+    as list of method numbers.'''
+    return np.stack([np.mean(bottlenecks[..., num1] == bottlenecks[..., num2], axis=-1) for num1, num2 in combination_numbers], axis=-1)
+
+# Calculate bottleneck according to Interdeparture Time Variance
+def calculate_itv_bottleneck(df, station_count, variance_intervall, append_aux_variables):
+    ''' Returns one new column per station with the interdeparture times variances, and a new attribute 
+    "bottleneck_itv" that gives the station number of the current interdeparture time bottleneck. '''
+
+    # Detect bottlenecks on the interdeparture times (aux variables only if requested)
     if append_aux_variables: 
-        df_itv = pd.concat([df, df_itv], axis=1)
+        bottleneck_itv, itv = detect_itv_bottleneck(get_column_views(df, 2*station_count+1, 3*station_count+1), variance_intervall, return_aux=True)
+        df_itv = pd.DataFrame(itv, index=df.index, columns=['itv_m{}'.format(i) for i in range(1, station_count+1)])
+        df_itv['bottleneck_itv'] = bottleneck_itv
     else: 
-        df_itv = pd.concat([df, df_itv['bottleneck_itv']], axis=1)
+        df_itv = pd.DataFrame({'bottleneck_itv': detect_itv_bottleneck(get_column_views(df, 2*station_count+1, 3*station_count+1), variance_intervall)}, index=df.index)
 
-    # Return all 
-    return df_itv
+    # Append new columns to dataframe 
+    return pd.concat([df, df_itv], axis=1)
 
 # Calculate bottleneck according to Active Period Method 
 def calculate_apm_bottleneck(df, station_count, append_aux_variables):
     ''' Determines the current bottleneck according to the active period method for each point in time, 
     and returns it as a new attribute called "bottleneck_apm".'''
 
-    # Create a supporting df containing only the machine states
-    df_apm = df[df.columns[station_count+1:2*station_count+1]]
-    
-    # Loop over all machines 
-    for machine in range(1, station_count+1):
-
-        # Get machine data as series
-        machine_states = df_apm['ms_m{m}'.format(m=machine)]
-        
-        # Reset list and last state for APM calculation
-        active_period_lengths = [] 
-        last_state = 0 
-
-        # Loop over entire simulation duration
-        for state in machine_states:
-
-            # Check if the machine continues to be active
-            if (last_state==0 and state==0): 
-
-                # Check for first observation and set default
-                if (len(active_period_lengths)==0):
-                    active_period_lengths += [1]
-                # Increase the active period counter by one
-                else: 
-                    active_period_lengths += [active_period_lengths[-1]+1]
-            
-            # Reset active period counter by appending a zero
-            else: 
-                active_period_lengths += [0]
-
-        # Return APM calculations to the supporting dataframe
-        df_apm.loc[:, 'apm_m' + str(machine)] = active_period_lengths
-
-    # Create new column with machine name with longest active period
-    df_apm['bottleneck_apm'] = df_apm[df_apm.columns[station_count:]].idxmax(axis=1)
-
-    # Convert bottleneck column to int for easy plotting
-    df_apm['bottleneck_apm'] = [int(bottleneck[5:]) for bottleneck in df_apm['bottleneck_apm']]
-
-    # Append new columns to the initial dataframe 
+    # Detect bottlenecks on the machine states (aux variables only if requested)
     if append_aux_variables: 
-        df_apm = pd.concat([df, df_apm[df_apm.columns[station_count:]]], axis=1)
+        bottleneck_apm, active_period_lengths = detect_apm_bottleneck(get_column_views(df, station_count+1, 2*station_count+1), return_aux=True)
+        df_apm = pd.DataFrame(active_period_lengths, index=df.index, columns=['apm_m{}'.format(i) for i in range(1, station_count+1)])
+        df_apm['bottleneck_apm'] = bottleneck_apm
     else: 
-        df_apm = pd.concat([df, df_apm['bottleneck_apm']], axis=1)
+        df_apm = pd.DataFrame({'bottleneck_apm': detect_apm_bottleneck(get_column_views(df, station_count+1, 2*station_count+1))}, index=df.index)
 
-    # Return all APMs
-    return df_apm
+    # Append new columns to dataframe 
+    return pd.concat([df, df_apm], axis=1)
 
 # Calculate bottleneck according to Arrow Method 
 def calculate_bnw_bottleneck(df, station_count, buffer_capacity): 
     ''' Determines the current bottleneck according to the bottleneck walk for each point in time, and 
     returns it as a new attribute called "bottleneck_bnw".'''
 
-    # Create a list to return bottleneck stations
-    bottleneck_bnw = []
-
-    # Limit data to buffer level 
-    df_bnw = df.iloc[:, 0:station_count+1]
-
-    # Calculate bottleneck limits 
-    bnw_upper_limit = round(buffer_capacity*(2/3), ndigits=0) # 3
-    bnw_lower_limit = round(buffer_capacity*(1/3), ndigits=0) # 2
-
-    # Iterate over all observations
-    for index, row in df_bnw.iterrows():
-
-        # Iterate over one point in time
-        for buffer_level, buffer_number in zip(row.values, range(len(row))):
-
-            # Check is the first bottleneck is currently observed
-            if buffer_number == 0: # Buffer level of B0 is always 1 (infinite)
-                continue
-
-            # Check if bottleneck is located downwards in the value stream
-            if buffer_level > bnw_upper_limit:
-                # IF so, continue for loop and check next buffer
-                continue 
-
-            # Check if the buffer level is at least above the lower limitation
-            elif buffer_level > bnw_lower_limit:
-                # Then no arrow can be placed, also continue the for loop
-                continue
-
-            # Turning of the arrow, indicated by a buffer level lower than the lower-limit
-            elif buffer_level < bnw_lower_limit: 
-                # Assign bottleneck to upstream station and break loop
-                bottleneck_bnw += [buffer_number]
-                # Exit row and return the number as bottleneck  
-                break 
-
-        # Check if no priority 1 bottleneck could be determined and assign station 7 as default ('customer bottleneck')
-        if len(bottleneck_bnw)==index:
-            # Use last as default for no assignments
-            bottleneck_bnw += [station_count]
-
-    # Add result list to return dataframe
-    df_bnw['bottleneck_bnw'] = bottleneck_bnw
+    # Detect bottlenecks on the buffer levels
+    bottleneck_bnw = detect_bnw_bottleneck(get_column_views(df, 0, station_count+1), buffer_capacity)
 
     # Return all (no aux variables to append)
-    return pd.concat([df, df_bnw['bottleneck_bnw']], axis=1)
\ No newline at end of file
+    return pd.concat([df, pd.Series(bottleneck_bnw, index=df.index, name='bottleneck_bnw')], axis=1)
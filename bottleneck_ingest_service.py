@@ -0,0 +1,492 @@
+import sys
+import math
+import asyncio
+import argparse
+import numpy as np
+
+from time import perf_counter
+from collections import deque
+
+##############################
+### Set up basic parameter ###
+
+# Total number of stations of each line
+STATION_COUNT = 7
+
+# Rolling window (in observations) of the interdeparture time variance
+VARIANCE_INTERVALL = 5000
+
+# Max capacity of all buffers (used for the bottleneck walk limits)
+BUFFER_CAPACITY = 5
+
+# Max number of ingested observations waiting for detection (sources are paused while full)
+QUEUE_SIZE = 10000
+
+# Max number of published bottlenecks waiting per subscriber (oldest are dropped while full)
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Number of most recent ingest-to-publish latencies kept for the percentiles
+LATENCY_SAMPLE_SIZE = 100000
+
+# Interval (in seconds) to check tailed files for new observations
+POLL_INTERVAL = 0.1
+
+def parse_observation(line, station_count=STATION_COUNT):
+    ''' Splits one row in the result csv layout (t, buffer levels, machine states, interdeparture times)
+    into its time step and the three lists of observations. Raises a ValueError for invalid rows.'''
+
+    # Split all values of the row
+    values = line.strip().split(',')
+
+    # Check number of values (e.g. truncated rows)
+    if len(values) != 3*station_count+2:
+        raise ValueError('expected {} values, got {}'.format(3*station_count+2, len(values)))
+
+    # Return time step, buffer levels, machine states and interdeparture times
+    return (int(values[0]),
+            [int(value) for value in values[1:station_count+2]],
+            [int(value) for value in values[station_count+2:2*station_count+2]],
+            [float(value) for value in values[2*station_count+2:3*station_count+2]])
+
+class Incremental_Bottleneck_Detection():
+
+    def __init__(self, station_count=STATION_COUNT, variance_intervall=VARIANCE_INTERVALL, buffer_capacity=BUFFER_CAPACITY):
+        '''Constructor for the ITV, APM and BNW detection state of a single line.'''
+
+        # Set number of stations and rolling window
+        self.station_count = station_count
+        self.variance_intervall = variance_intervall
+
+        # Count all observations of the line
+        self.observation_count = 0
+
+        # Set up rolling window of interdeparture times per machine (observation number, value)
+        self.itv_windows = [deque() for _ in range(station_count)]
+        # Set up shifted sums of the rolling window (shift by first value for numerical stability)
+        self.itv_shifts = [None] * station_count
+        self.itv_sums = [0.0] * station_count
+        self.itv_square_sums = [0.0] * station_count
+
+        # Set up current active period lengths of all machines
+        self.active_period_lengths = [0] * station_count
+
+        # Calculate bottleneck walk limits
+        self.bnw_upper_limit = round(buffer_capacity*(2/3), ndigits=0)
+        self.bnw_lower_limit = round(buffer_capacity*(1/3), ndigits=0)
+
+    def update_itv(self, interdeparture_times):
+        ''' Updates the rolling interdeparture time variances and returns the machine number with the
+        lowest variance (0 if no variance is available yet).'''
+
+        # Set up current variances of all machines
+        variances = []
+
+        # Loop over all machines
+        for machine, value in enumerate(interdeparture_times):
+
+            # Get rolling window of the machine
+            window = self.itv_windows[machine]
+
+            # Add new interdeparture time to the window
+            if not math.isnan(value):
+                if self.itv_shifts[machine] is None:
+                    self.itv_shifts[machine] = value
+                window.append((self.observation_count, value))
+                self.itv_sums[machine] += value - self.itv_shifts[machine]
+                self.itv_square_sums[machine] += (value - self.itv_shifts[machine])**2
+
+            # Remove interdeparture times that dropped out of the window
+            while window and window[0][0] <= self.observation_count - self.variance_intervall:
+                _, old_value = window.popleft()
+                self.itv_sums[machine] -= old_value - self.itv_shifts[machine]
+                self.itv_square_sums[machine] -= (old_value - self.itv_shifts[machine])**2
+
+            # Calculate sample variance (requires at least two values)
+            count = len(window)
+            if count < 2:
+                variances += [math.nan]
+            else:
+                variances += [max(0.0, (self.itv_square_sums[machine] - self.itv_sums[machine]**2/count) / (count-1))]
+
+        # Get machine with lowest variance (first one on ties)
+        available = [(variance, machine) for machine, variance in enumerate(variances) if not math.isnan(variance)]
+        return min(available)[1] + 1 if available else 0
+
+    def update_apm(self, machine_states):
+        ''' Updates the active period lengths and returns the machine number with the longest active period.'''
+
+        # Increase active period of all active machines, reset all others
+        self.active_period_lengths = [length + 1 if state == 0 else 0 for length, state in zip(self.active_period_lengths, machine_states)]
+
+        # Return machine with longest active period (first one on ties)
+        return self.active_period_lengths.index(max(self.active_period_lengths)) + 1
+
+    def update_bnw(self, buffer_levels):
+        ''' Returns the machine number of the current bottleneck according to the bottleneck walk.'''
+
+        # Loop over all buffers except the infinite B0
+        for buffer_number in range(1, self.station_count+1):
+
+            # Turning of the arrow, indicated by a buffer level lower than the lower-limit
+            if buffer_levels[buffer_number] < self.bnw_lower_limit:
+                return buffer_number
+
+        # Use last station as default ('customer bottleneck')
+        return self.station_count
+
+    def update(self, buffer_levels, machine_states, interdeparture_times):
+        ''' Updates the state of all three methods with one observation and returns the current bottlenecks.'''
+
+        # Count observation
+        self.observation_count += 1
+
+        # Return current bottleneck of all methods
+        return {'itv': self.update_itv(interdeparture_times),
+                'apm': self.update_apm(machine_states),
+                'bnw': self.update_bnw(buffer_levels)}
+
+class Bottleneck_Ingest_Service():
+
+    def __init__(self, station_count=STATION_COUNT, variance_intervall=VARIANCE_INTERVALL, buffer_capacity=BUFFER_CAPACITY, queue_size=QUEUE_SIZE):
+        '''Constructor for a service that ingests observation streams and publishes the current bottlenecks.'''
+
+        # Set detection parameters
+        self.station_count = station_count
+        self.variance_intervall = variance_intervall
+        self.buffer_capacity = buffer_capacity
+
+        # Set up bounded queue of ingested observations (line id, ingest time, parsed row)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        # Set up detection state and current bottlenecks per line
+        self.detections = {}
+        self.current_bottlenecks = {}
+
+        # Set up queues of all subscribers
+        self.subscribers = []
+
+        # Set up the most recent ingest-to-publish latencies
+        self.latencies = deque(maxlen=LATENCY_SAMPLE_SIZE)
+
+        # Count rows that were skipped as invalid
+        self.skipped_rows = 0
+
+    async def ingest(self, line_id, row):
+        ''' Parses one observation row of a line and adds it to the queue (waits while the queue is full).
+        Invalid rows (e.g. headers, truncated writes or non-numeric values) are reported and skipped.'''
+
+        # Get ingest time before parsing, so the latency includes it
+        ingest_time = perf_counter()
+
+        # Parse row before queueing, so the detection only gets valid observations
+        try:
+            observation = parse_observation(row, self.station_count)
+        except ValueError as error:
+            self.skipped_rows += 1
+            print('{}: skipped invalid row {!r} ({})'.format(line_id, row[:80], error), file=sys.stderr)
+            return
+
+        # Add observation to the queue
+        await self.queue.put((line_id, ingest_time, observation))
+
+    async def ingest_stream(self, reader, line_id):
+        ''' Ingests all rows of an asyncio stream reader until the end of the stream.
+        A row "#line <id>" renames the line for all following rows.'''
+
+        # Read row by row (no further rows are read while the queue is full)
+        async for line in reader:
+            row = line.decode().strip()
+
+            # Skip empty rows and check for a new line id
+            if not row:
+                continue
+            if row.startswith('#'):
+                if row.startswith('#line '):
+                    line_id = row[6:].strip()
+                continue
+
+            # Ingest observation
+            await self.ingest(line_id, row)
+
+    async def ingest_file(self, file_path, line_id=None, from_start=True, poll_interval=POLL_INTERVAL):
+        ''' Follows a result csv (like tail -f) and ingests all appended rows.'''
+
+        # Use file path as default line id
+        line_id = line_id or file_path
+
+        with open(file_path, 'r') as result_file:
+
+            # Skip existing rows if requested
+            if not from_start:
+                result_file.seek(0, 2)
+
+            # Keep incomplete rows until the writer finished them
+            incomplete_row = ''
+
+            while True:
+                line = result_file.readline()
+
+                # Wait for new rows at the end of the file
+                if not line:
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+                # Complete partially written rows
+                incomplete_row += line
+                if not incomplete_row.endswith('\n'):
+                    continue
+
+                # Ingest observation
+                row, incomplete_row = incomplete_row.strip(), ''
+                if row:
+                    await self.ingest(line_id, row)
+
+    async def ingest_stdin(self, line_id='stdin'):
+        ''' Ingests all rows from stdin.'''
+
+        # Connect stdin to an asyncio stream reader
+        reader = asyncio.StreamReader()
+        await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        # Ingest all rows
+        await self.ingest_stream(reader, line_id)
+
+    async def serve_socket(self, host='127.0.0.1', port=0):
+        ''' Starts a local socket server that ingests each connection as its own line and returns the server.'''
+
+        # Count connections for default line ids
+        connection_numbers = iter(range(1, sys.maxsize))
+
+        async def handle_connection(reader, writer):
+            try:
+                await self.ingest_stream(reader, 'socket-{}'.format(next(connection_numbers)))
+            finally:
+                writer.close()
+
+        # Start server
+        return await asyncio.start_server(handle_connection, host, port)
+
+    def subscribe(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        ''' Returns a new bounded queue that receives all published bottlenecks (line id, t, bottlenecks).'''
+        queue = asyncio.Queue(maxsize=queue_size)
+        self.subscribers += [queue]
+        return queue
+
+    def publish(self, line_id, t, bottlenecks):
+        ''' Publishes the current bottlenecks of a line to all subscribers.'''
+
+        # Update current bottlenecks of the line
+        self.current_bottlenecks[line_id] = bottlenecks
+
+        # Loop over all subscribers
+        for queue in self.subscribers:
+
+            # Drop oldest bottlenecks for slow subscribers (only the most recent bottlenecks are relevant)
+            if queue.full():
+                queue.get_nowait()
+
+            # Publish to subscriber
+            queue.put_nowait((line_id, t, dict(bottlenecks)))
+
+    async def run(self):
+        ''' Detects and publishes the bottlenecks of all ingested observations.'''
+
+        while True:
+
+            # Get next observation
+            line_id, ingest_time, (t, buffer_levels, machine_states, interdeparture_times) = await self.queue.get()
+
+            try:
+                # Set up detection state for new lines
+                if line_id not in self.detections:
+                    self.detections[line_id] = Incremental_Bottleneck_Detection(self.station_count, self.variance_intervall, self.buffer_capacity)
+
+                # Update detection state with observation
+                bottlenecks = self.detections[line_id].update(buffer_levels, machine_states, interdeparture_times)
+
+                # Publish current bottlenecks
+                self.publish(line_id, t, bottlenecks)
+
+                # Track latency from ingest to publish
+                self.latencies.append(perf_counter() - ingest_time)
+
+            # Report and skip observations that can't be detected, so one bad row never stops the detection
+            except Exception as error:
+                self.skipped_rows += 1
+                print('{}: skipped observation t={} ({!r})'.format(line_id, t, error), file=sys.stderr)
+
+            # Mark observation as done in any case (sources waiting on the full queue continue)
+            finally:
+                self.queue.task_done()
+
+    def get_latency_percentiles(self, percentiles=(50, 90, 99, 99.9)):
+        ''' Returns a dict with the given percentiles of the ingest-to-publish latency (in seconds).'''
+        if not self.latencies:
+            return {percentile: math.nan for percentile in percentiles}
+        return dict(zip(percentiles, np.percentile(self.latencies, percentiles)))
+
+async def produce_simulation(host, port, process_times, simulation_time, line_id=None, seed=42):
+    ''' Runs the factory simulation as stand-in for a line controller and writes every observation to the
+    socket of the service (waits while the service applies backpressure).'''
+
+    from factory_simulation_loop import Factory_Simulation
+
+    # Reset seed to default number
+    np.random.seed(seed=seed)
+
+    # Set up factory and run all machines
+    factory = Factory_Simulation(process_times)
+    for name, machine in factory.all_machines.items():
+        factory.env.process(machine.run_machine(factory.env))
+
+    # Connect to the service
+    reader, writer = await asyncio.open_connection(host, port)
+    if line_id:
+        writer.write('#line {}\n'.format(line_id).encode())
+
+    # Iter over simulation time
+    for t in range(1, simulation_time):
+
+        # Reset ITV of all machines and run env until t
+        factory.reset_interdeparture_times()
+        factory.env.run(until=t)
+
+        # Write observation in the result csv layout
+        new_line = [t] + factory.get_buffer_level() + factory.get_machine_states() + factory.get_interdeparture_times()
+        writer.write((','.join(str(value) for value in new_line) + '\n').encode())
+
+        # Wait while the socket buffer is full
+        await writer.drain()
+
+    # Close connection
+    writer.close()
+    await writer.wait_closed()
+
+async def check_round_trip(file_path, queue_size=100, station_count=STATION_COUNT, variance_intervall=VARIANCE_INTERVALL, buffer_capacity=BUFFER_CAPACITY):
+    ''' Sends a result csv (plus an invalid header row) through the local socket of a service with a small
+    queue, so the producer is paused by backpressure, and compares all published bottlenecks with the
+    array detectors. Returns the ratio of matching bottlenecks per method and the number of skipped rows.'''
+
+    from bottleneck_determination import detect_itv_bottleneck, detect_apm_bottleneck, detect_bnw_bottleneck
+
+    # Load all rows of the result csv
+    with open(file_path, 'r') as result_file:
+        rows = [row.strip() for row in result_file if row.strip()]
+
+    # Detect reference bottlenecks with the array detectors
+    observations = [parse_observation(row, station_count) for row in rows]
+    reference = {'itv': detect_itv_bottleneck(np.array([observation[3] for observation in observations]), variance_intervall),
+                 'apm': detect_apm_bottleneck(np.array([observation[2] for observation in observations])),
+                 'bnw': detect_bnw_bottleneck(np.array([observation[1] for observation in observations]), buffer_capacity)}
+
+    # Set up service with small queue and a subscriber that keeps all published bottlenecks
+    service = Bottleneck_Ingest_Service(station_count, variance_intervall, buffer_capacity, queue_size)
+    subscriber = service.subscribe(queue_size=len(rows))
+    detection = asyncio.create_task(service.run())
+    server = await service.serve_socket()
+
+    # Write header and all rows to the socket (waits while the service applies backpressure)
+    reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+    writer.write('#line check\n'.encode())
+    writer.write((','.join(['t'] + ['col_{}'.format(i) for i in range(3*station_count+1)]) + '\n').encode())
+    for row in rows:
+        writer.write((row + '\n').encode())
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+    # Collect all published bottlenecks (stop at timeout or if the detection died)
+    published = []
+    while len(published) < len(rows) and not detection.done():
+        try:
+            published += [(await asyncio.wait_for(subscriber.get(), timeout=5))[2]]
+        except asyncio.TimeoutError:
+            break
+
+    # Stop service
+    server.close()
+    detection.cancel()
+
+    # Return ratio of matching bottlenecks (missing ones count as mismatch) and number of skipped rows
+    return ({method: sum(bottlenecks[method] == reference[method][i] for i, bottlenecks in enumerate(published)) / len(rows) for method in reference},
+            service.skipped_rows)
+
+def check_tasks(tasks):
+    ''' Raises the exception of the first task that died (sources and detection run forever otherwise).'''
+    for task in tasks:
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            raise RuntimeError('task {} failed'.format(task.get_name())) from task.exception()
+
+async def main(arguments):
+    ''' Runs the service with the sources given on the command line and prints all bottleneck changes.'''
+
+    # Set up service
+    service = Bottleneck_Ingest_Service(arguments.station_count, arguments.variance_intervall, arguments.buffer_capacity, arguments.queue_size)
+    subscriber = service.subscribe()
+
+    # Start detection
+    tasks = [asyncio.create_task(service.run())]
+
+    # Start all sources
+    for file_path in arguments.file:
+        tasks += [asyncio.create_task(service.ingest_file(file_path))]
+    if arguments.stdin:
+        tasks += [asyncio.create_task(service.ingest_stdin())]
+    if arguments.port is not None or arguments.simulate:
+        server = await service.serve_socket(arguments.host, arguments.port or 0)
+        port = server.sockets[0].getsockname()[1]
+        print('Listening on {}:{}'.format(arguments.host, port))
+
+    # Start local stand-in producer
+    if arguments.simulate:
+        producer = asyncio.create_task(produce_simulation(arguments.host, port, [10, 12, 10, 10, 12, 10, 10], arguments.simulate, 'simulation'))
+
+    # Print all changes of the published bottlenecks
+    last_bottlenecks = {}
+    while True:
+        try:
+            line_id, t, bottlenecks = await asyncio.wait_for(subscriber.get(), timeout=1)
+        except asyncio.TimeoutError:
+            # Report dead detection, sources or producer
+            check_tasks(tasks + ([producer] if arguments.simulate else []))
+            # Stop once the stand-in producer finished and all observations are published
+            if arguments.simulate and producer.done() and service.queue.empty():
+                break
+            # Stop once stdin is the only source and all observations are published
+            if arguments.stdin and not arguments.file and arguments.port is None and not arguments.simulate and tasks[-1].done() and service.queue.empty():
+                break
+            continue
+        if last_bottlenecks.get(line_id) != bottlenecks:
+            print('{} t={}: {}'.format(line_id, t, bottlenecks))
+            last_bottlenecks[line_id] = bottlenecks
+
+    # Print latency percentiles
+    for percentile, latency in service.get_latency_percentiles().items():
+        print('p{}: {:.3f} ms'.format(percentile, latency*1000))
+
+if __name__ == '__main__':
+
+    # Parse sources and detection parameters
+    parser = argparse.ArgumentParser(description='Ingest observation streams and publish the current bottlenecks.')
+    parser.add_argument('--file', action='append', default=[], help='result csv to follow (can be repeated)')
+    parser.add_argument('--stdin', action='store_true', help='ingest rows from stdin')
+    parser.add_argument('--host', default='127.0.0.1', help='host of the local socket')
+    parser.add_argument('--port', type=int, default=None, help='port of the local socket (0 for any free port)')
+    parser.add_argument('--simulate', type=int, default=0, metavar='T', help='run a local simulation for T time steps as producer')
+    parser.add_argument('--check', default=None, metavar='FILE', help='send a result csv through the socket and compare with the array detectors')
+    parser.add_argument('--station-count', type=int, default=STATION_COUNT)
+    parser.add_argument('--variance-intervall', type=int, default=VARIANCE_INTERVALL)
+    parser.add_argument('--buffer-capacity', type=int, default=BUFFER_CAPACITY)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+
+    arguments = parser.parse_args()
+
+    # Run round-trip check
+    if arguments.check:
+        ratios, skipped_rows = asyncio.run(check_round_trip(arguments.check, station_count=arguments.station_count,
+                                                            variance_intervall=arguments.variance_intervall, buffer_capacity=arguments.buffer_capacity))
+        print('Matching bottlenecks: {} ({} skipped rows)'.format(ratios, skipped_rows))
+        sys.exit(0 if all(ratio == 1 for ratio in ratios.values()) and skipped_rows == 1 else 1)
+
+    # Run service
+    asyncio.run(main(arguments))
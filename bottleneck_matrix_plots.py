@@ -2,6 +2,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 from bottleneck_determination import calculate_itv_bottleneck, calculate_apm_bottleneck, calculate_bnw_bottleneck
+from scenario_canonicalization import get_process_times, get_scenario_key, get_result_file_path
+from factory_simulation_loop import SEED, ENGINE_PARAMETERS
 
 # Set total number of stations for import 
 station_count = 7
@@ -24,6 +26,9 @@ column_names = buffer_level_cols + machine_state_cols + process_times_cols
 bottleneck_type = ['bnw', 'apm', 'itv']
 bottleneck_name = ['Bottleneck Walk (BNW)', 'Active Period Method (APM)', 'Interdeparture Time Variance (ITV)']
 
+# Memo of detected bottlenecks per canonical scenario key and type (symmetric scenarios are only detected once)
+detection_results = {}
+
 # Loop all bottleneck process times
 for bn_pt in range(11, 21, 1): # not for calculations, just used to loop files
 
@@ -44,32 +49,42 @@ for bn_pt in range(11, 21, 1): # not for calculations, just used to loop files
         for m in range(1,6):
             for n in range(1,6):
 
-                # Get file path as string for import
-                file_path = 'results_bn-pt_{bn_pt}/result_25k_bn({bn1},{bn2})_bn-pt({bn_pt}).csv'.format(bn1=m, bn2=n, bn_pt=bn_pt)
-
-                # Load data 
-                data = pd.read_csv(file_path, names=column_names).reset_index(drop=True)
-
-                # Determine bottlenecks 
-                if bn_type=='itv':
-                    # Interdeparture Time Variance
-                    data = calculate_itv_bottleneck(df=data, 
-                                                    station_count=station_count, 
-                                                    variance_intervall=5000, 
-                                                    append_aux_variables=False)
-                elif bn_type=='apm':
-                    # Active Period Method
-                    data = calculate_apm_bottleneck(df=data, 
-                                                    station_count=station_count, 
-                                                    append_aux_variables=False)
-                elif bn_type=='bnw':
-                    # Bottleneck Walk
-                    data = calculate_bnw_bottleneck(df=data, 
-                                                    station_count=station_count, 
-                                                    buffer_capacity=5)
-
-                # Limit observations to all observations after the system is swung in
-                data = data[5000:25000]
+                # Get canonical key of the scenario, since (m, n) and (n, m) share the same simulation
+                scenario_key = get_scenario_key(get_process_times(m, n, bn_pt), SEED, **ENGINE_PARAMETERS)
+
+                # Resolve aliases to the already detected bottlenecks
+                if (scenario_key, bn_type) in detection_results:
+                    data = detection_results[(scenario_key, bn_type)]
+                else:
+                    # Get file path as string for import
+                    file_path = get_result_file_path(bn_pt, m, n)
+
+                    # Load data 
+                    data = pd.read_csv(file_path, names=column_names).reset_index(drop=True)
+
+                    # Determine bottlenecks 
+                    if bn_type=='itv':
+                        # Interdeparture Time Variance
+                        data = calculate_itv_bottleneck(df=data, 
+                                                        station_count=station_count, 
+                                                        variance_intervall=5000, 
+                                                        append_aux_variables=False)
+                    elif bn_type=='apm':
+                        # Active Period Method
+                        data = calculate_apm_bottleneck(df=data, 
+                                                        station_count=station_count, 
+                                                        append_aux_variables=False)
+                    elif bn_type=='bnw':
+                        # Bottleneck Walk
+                        data = calculate_bnw_bottleneck(df=data, 
+                                                        station_count=station_count, 
+                                                        buffer_capacity=5)
+
+                    # Limit observations to all observations after the system is swung in (and to the bottleneck column)
+                    data = data[5000:25000][['bottleneck_' + bn_type]]
+
+                    # Memorize the detected bottlenecks for all aliases
+                    detection_results[(scenario_key, bn_type)] = data
 
                 # Set up ax for subplot (5 x 5 plot for seven stations)
                 ax = fig.add_subplot(station_count-2, station_count-2, counter)
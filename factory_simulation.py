@@ -1,9 +1,9 @@
 import simpy
 import random
+import numpy as np
 import pandas as pd
 
 from csv import writer
-from numpy.core.numeric import NaN
 
 ##############################
 ### Set up basic parameter ###
@@ -20,21 +20,35 @@ INITIAL_CAPACITY = 1
 # Std. dev. for process time variation
 STANDARD_DEVIATION = 0.1
 
+# Process time distribution per machine name, e.g. {'m3': Process_Time_Distribution('skewnorm', a=10)}
+# (machines without an entry keep the exact Gaussian draws)
+PROCESS_TIME_DISTRIBUTIONS = {}
+
+# Number of variability multipliers drawn at once from table-based distributions
+SAMPLE_BATCH_SIZE = 1024
+
 # Process times in the scenario
 PROCESS_TIMES = [10, 10, 10, 10, 10, 10, 10, 10, 10, 10]
 
-# Set seed to default number
+# Set seed to default number (numpy for the table-based distributions)
 random.seed(42)
+np.random.seed(42)
 
 class Machine():
 
-    def __init__(self, process_time, machine_name):
+    def __init__(self, process_time, machine_name, distribution=None):
         '''Constructor for a single machine in the factory simulation.'''
         
         # Set process time 
         self.process_time = process_time
         # Set default name
         self.machine_name = machine_name
+
+        # Set process time distribution (None for exact Gaussian draws)
+        self.distribution = distribution
+        # Initialize batch of drawn variability multipliers
+        self.samples = []
+        self.sample_index = 0
     
         # Set initial machine state
         self.machine_state = 0
@@ -50,8 +64,20 @@ class Machine():
         self.buffer_downstream = 'b{}'.format(self.machine_name[1:])
 
     def apply_variability(self, process_time):
-        ''' Applies a Gaussian normal distribution to the process time.'''
-        return max(0, random.gauss(process_time, process_time*STANDARD_DEVIATION))
+        ''' Applies the process time distribution of the machine (default: Gaussian normal) to the process time.'''
+
+        # Draw exactly from the default Gaussian normal distribution
+        if self.distribution is None:
+            return max(0, random.gauss(process_time, process_time*STANDARD_DEVIATION))
+
+        # Draw the next batch of multipliers from the lookup table of the distribution
+        if self.sample_index == len(self.samples):
+            self.samples = self.distribution.sample(SAMPLE_BATCH_SIZE)
+            self.sample_index = 0
+
+        # Take next multiplier from the batch
+        self.sample_index += 1
+        return self.samples[self.sample_index-1]*process_time
     
     def run_machine(self, env):
         '''Run the machining process to consume material and produce (semi-) finished goods.'''
@@ -85,7 +111,7 @@ class Machine():
 
 class Factory_Simulation():
 
-    def __init__(self, process_times):
+    def __init__(self, process_times, distributions=PROCESS_TIME_DISTRIBUTIONS):
         ''' Constructor class for factory simulation.'''
 
         # Set up simpy environment
@@ -113,7 +139,7 @@ class Factory_Simulation():
 
         # Set up all machines in dict
         for name, time in zip(self.machine_names, self.process_times):
-            self.all_machines[name] = Machine(time, name)
+            self.all_machines[name] = Machine(time, name, distributions.get(name))
 
     def get_buffer_level(self):
         ''' Returns a list of the current level of all buffers.'''
@@ -130,7 +156,7 @@ class Factory_Simulation():
     def reset_interdeparture_times(self):
         ''' Resets the interdeparture time for all machines back to zero.'''
         for machine in self.all_machines.values():
-            machine.interdeparture_time = NaN
+            machine.interdeparture_time = np.nan
 
 # Set up factory
 factory = Factory_Simulation(PROCESS_TIMES)
@@ -1,12 +1,15 @@
 import simpy
+import shutil
 import numpy as np
 import pandas as pd
 
 from tqdm import tqdm
 from csv import writer
 from datetime import datetime
+from multiprocessing import Pool
 from scipy.stats import skewnorm
-from numpy.core.numeric import NaN
+from process_time_distributions import get_distributions_key
+from scenario_canonicalization import get_process_times, get_result_file_path, get_unique_scenarios
 
 ##############################
 ### Set up basic parameter ###
@@ -20,15 +23,38 @@ BUFFER_CAPACITY = 5
 # Initial capacity of all buffers 
 INITIAL_CAPACITY = 1
 
+# Process time distribution per machine name, e.g. {'m3': Process_Time_Distribution('lognormal', sigma=0.3)}
+# (machines without an entry keep the exact skewnorm draws used for the paper results)
+PROCESS_TIME_DISTRIBUTIONS = {}
+
+# Number of variability multipliers drawn at once from table-based distributions
+SAMPLE_BATCH_SIZE = 1024
+
+# Seed that is reset before each scenario
+SEED = 42
+
+# Engine parameters that (together with process times and seed) identify a unique simulation
+ENGINE_PARAMETERS = {
+    'simulation_time': SIMULATION_TIME,
+    'buffer_capacity': BUFFER_CAPACITY,
+    'initial_capacity': INITIAL_CAPACITY,
+    'process_time_distributions': get_distributions_key(PROCESS_TIME_DISTRIBUTIONS)}
+
 class Machine():
 
-    def __init__(self, process_time, machine_name):
+    def __init__(self, process_time, machine_name, distribution=None):
         '''Constructor for a single machine in the factory simulation.'''
         
         # Set process time 
         self.process_time = process_time
         # Set default name
         self.machine_name = machine_name
+
+        # Set process time distribution (None for exact skewnorm draws)
+        self.distribution = distribution
+        # Initialize batch of drawn variability multipliers
+        self.samples = []
+        self.sample_index = 0
     
         # Set initial machine state
         self.machine_state = 0
@@ -38,52 +64,128 @@ class Machine():
         # Initialize interdeparture time
         self.interdeparture_time = 0
 
+        # Initialize departure events (departure time, interdeparture time) for event-based ITV
+        self.departure_events = []
+
+        # Initialize end of the current machining and the event the machine waits for (required for snapshots)
+        self.machining_end_time = 0
+        self.pending_event = None
+
         # Get name of upstream buffer
         self.buffer_upstream = 'b{}'.format(int(self.machine_name[1:])-1)
         # Get number downstream buffer 
         self.buffer_downstream = 'b{}'.format(self.machine_name[1:])
 
     def apply_variability(self, process_time):
-        ''' Applies a Exponential distribution to the process time.'''
-        return (skewnorm.rvs(a=10, loc=1, size=1)*process_time)[0]
+        ''' Applies the process time distribution of the machine (default: skewnorm) to the process time.'''
+
+        # Draw exactly from the default skewnorm distribution
+        if self.distribution is None:
+            return (skewnorm.rvs(a=10, loc=1, size=1)*process_time)[0]
 
-    def run_machine(self, env):
-        '''Run the machining process to consume material and produce (semi-) finished goods.'''
+        # Draw the next batch of multipliers from the lookup table of the distribution
+        if self.sample_index == len(self.samples):
+            self.samples = self.distribution.sample(SAMPLE_BATCH_SIZE)
+            self.sample_index = 0
+
+        # Take next multiplier from the batch
+        self.sample_index += 1
+        return self.samples[self.sample_index-1]*process_time
+
+    def run_machine(self, env, resume_phase='get', remaining_time=None):
+        '''Run the machining process to consume material and produce (semi-) finished goods. A restored 
+        machine resumes in the given phase ('get', 'machining' or 'put') with the remaining machining time.'''
 
         while True:
 
-            # Change machine state to starved 
-            self.machine_state = 1
-       
-            # Get material from upstream buffer
-            if self.buffer_upstream != 'b0': # infinite b0, since no material is ever 'really' taken from B0
-                yield env.all_buffer[self.buffer_upstream].get(1)
-            
-            # Change machine state to active 
-            self.machine_state = 0
-            
-            # Machining 
-            yield env.timeout(self.apply_variability(self.process_time))
+            if resume_phase == 'get':
+
+                # Change machine state to starved 
+                self.machine_state = 1
+           
+                # Get material from upstream buffer
+                if self.buffer_upstream != 'b0': # infinite b0, since no material is ever 'really' taken from B0
+                    self.pending_event = env.all_buffer[self.buffer_upstream].get(1)
+                    yield self.pending_event
+
+            if resume_phase in ('get', 'machining'):
+                
+                # Change machine state to active 
+                self.machine_state = 0
+                
+                # Machining (a restored machine only finishes the remaining time)
+                if remaining_time is None:
+                    remaining_time = self.apply_variability(self.process_time)
+                self.machining_end_time = env.now + remaining_time
+                self.pending_event = env.timeout(remaining_time)
+                yield self.pending_event
+                remaining_time = None
+
+                # Calculate time since last finished product (inter-departure time)
+                self.interdeparture_time = env.now - self.last_departure_time 
 
-            # Calculate time since last finished product (inter-departure time)
-            self.interdeparture_time = env.now - self.last_departure_time 
+                # Reset last departure time for the next product
+                self.last_departure_time = env.now 
 
-            # Reset last departure time for the next product
-            self.last_departure_time = env.now 
+                # Record departure event
+                self.departure_events.append((env.now, self.interdeparture_time))
 
             # Change machine state to blocked 
             self.machine_state = 2
 
             # Put finished good into downstream buffer
-            yield env.all_buffer[self.buffer_downstream].put(1)
+            self.pending_event = env.all_buffer[self.buffer_downstream].put(1)
+            yield self.pending_event
+
+            # Continue with the next product
+            resume_phase = 'get'
+
+    def get_state(self, env):
+        ''' Returns the serializable state of the machine at the current time of the environment.'''
+
+        # Check if the event the machine waits for already happened but was not processed yet
+        pending_event_triggered = self.pending_event is not None and self.pending_event.triggered
+
+        # Get phase to resume in (a triggered event counts as finished)
+        if self.machine_state == 1:
+            resume_phase = 'machining' if pending_event_triggered else 'get'
+        elif self.machine_state == 0:
+            resume_phase = 'machining'
+        else:
+            resume_phase = 'get' if pending_event_triggered else 'put'
+
+        # Get remaining machining time (None if no machining started yet)
+        remaining_time = max(0, self.machining_end_time - env.now) if self.machine_state == 0 else None
+
+        # Return state as dict
+        return {'machine_state': self.machine_state,
+                'resume_phase': resume_phase,
+                'remaining_time': remaining_time,
+                'last_departure_time': self.last_departure_time,
+                'interdeparture_time': self.interdeparture_time,
+                'departure_events': [list(event) for event in self.departure_events],
+                'samples': [float(sample) for sample in self.samples],
+                'sample_index': self.sample_index}
+
+    def set_state(self, state):
+        ''' Restores the state of the machine (except its running process).'''
+        self.machine_state = state['machine_state']
+        self.last_departure_time = state['last_departure_time']
+        self.interdeparture_time = state['interdeparture_time']
+        self.departure_events = [tuple(event) for event in state['departure_events']]
+        self.samples = np.array(state['samples'])
+        self.sample_index = state['sample_index']
 
 class Factory_Simulation():
 
-    def __init__(self, process_times):
+    def __init__(self, process_times, distributions=PROCESS_TIME_DISTRIBUTIONS, initial_time=0, buffer_levels=None):
         ''' Constructor class for factory simulation.'''
 
         # Set up simpy environment
-        self.env = simpy.Environment()
+        self.env = simpy.Environment(initial_time=initial_time)
+
+        # Set process time distributions of all machines
+        self.distributions = distributions
 
         # Define processing times according to scenario
         self.process_times = process_times
@@ -98,16 +200,19 @@ class Factory_Simulation():
         # Create dict for all buffers
         self.env.all_buffer = {}
 
+        # Set initial buffer levels (all buffers start with the initial capacity unless restored)
+        buffer_levels = buffer_levels or [INITIAL_CAPACITY] * len(self.buffer_names)
+
         # Set up all buffers in dict
-        for buffer in self.buffer_names:
+        for buffer, level in zip(self.buffer_names, buffer_levels):
             if buffer != 'b{}'.format(len(self.process_times)):
-                self.env.all_buffer[buffer] = simpy.Container(self.env, capacity=BUFFER_CAPACITY, init=INITIAL_CAPACITY)
+                self.env.all_buffer[buffer] = simpy.Container(self.env, capacity=BUFFER_CAPACITY, init=level)
             else: # infinite customer buffer
-                self.env.all_buffer[buffer] = simpy.Container(self.env, capacity=999999, init=INITIAL_CAPACITY) # virtually unlimited
+                self.env.all_buffer[buffer] = simpy.Container(self.env, capacity=999999, init=level) # virtually unlimited
 
         # Set up all machines in dict
         for name, time in zip(self.machine_names, self.process_times):
-            self.all_machines[name] = Machine(time, name)
+            self.all_machines[name] = Machine(time, name, distributions.get(name))
 
     # Required for BNW bottleneck detection
     def get_buffer_level(self):
@@ -128,57 +233,171 @@ class Factory_Simulation():
     def reset_interdeparture_times(self):
         ''' Resets the interdeparture time for all machines back to zero.'''
         for machine in self.all_machines.values():
-            machine.interdeparture_time = NaN
+            machine.interdeparture_time = np.nan
+
+    # Required for event-based ITV bottleneck detection
+    def get_departure_events(self):
+        ''' Returns the departure events (tick, interdeparture time) of all machines as pair of arrays per 
+        machine. Ticks match the rows of the result csv (tick t-1 for the row written after env.run(until=t)), 
+        and only the last departure of a tick is kept, like in the per-tick interdeparture times.'''
+
+        # Set up list of departure events
+        departure_events = []
+
+        # Loop over all machines
+        for machine in self.all_machines.values():
+
+            # Get departure times and interdeparture times as arrays
+            events = np.array(machine.departure_events).reshape(-1, 2)
+            ticks = np.floor(events[:, 0]).astype(np.int64)
+
+            # Keep only the last departure of each tick
+            last_of_tick = np.append(ticks[1:] != ticks[:-1], True) if len(ticks) else np.ones(0, dtype=bool)
+            departure_events += [(ticks[last_of_tick], events[last_of_tick, 1])]
+
+        # Return all departure events
+        return departure_events
+
+    # Required to fork replications and what-if variants from a warmed-up line
+    def snapshot(self):
+        ''' Returns the serializable state of the line (buffer levels, machine states, remaining machining 
+        times, departure times and random state). Take snapshots between runs of the environment.'''
+
+        # Get random state as lists
+        random_state = np.random.get_state()
+
+        # Return state as dict of builtin types (can be pickled or saved as json)
+        return {'time': self.env.now,
+                'process_times': list(self.process_times),
+                'buffer_levels': self.get_buffer_level(),
+                'machines': {name: machine.get_state(self.env) for name, machine in self.all_machines.items()},
+                'random_state': [random_state[0], random_state[1].tolist()] + list(random_state[2:])}
+
+    @classmethod
+    def from_snapshot(cls, snapshot, process_times=None, seed=None, distributions=PROCESS_TIME_DISTRIBUTIONS):
+        ''' Returns a new factory simulation with running machines that continues from the snapshot. 
+        Process times can be changed for what-if variants (machining in progress is kept), and a seed 
+        replaces the stored random state for independent replications.'''
 
-# Loop over all processing time scenarios
-for pt_bottleneck in range(11, 21, 1): # from 10% to 100% extra time for bottlenecks
+        # Set up factory at the time and buffer levels of the snapshot
+        factory = cls(process_times or snapshot['process_times'], distributions, snapshot['time'], snapshot['buffer_levels'])
 
-    # Print bottleneck percentage progressions
-    print(datetime.now().strftime("%H:%M:%S")+ ' - Running simulations for {} bottleneck'.format(str(pt_bottleneck-10)+'0%'))
+        # Restore random state or reseed for a new replication
+        if seed is None:
+            random_state = snapshot['random_state']
+            np.random.set_state((random_state[0], np.array(random_state[1], dtype=np.uint32)) + tuple(random_state[2:]))
+        else:
+            np.random.seed(seed=seed)
 
-    # Loop over m stations
-    for m in range(1,6): # M1 and M7 excluded, since the system boundaries are unlimited
+        # Restore all machines and resume their processes
+        for name, machine in factory.all_machines.items():
+            state = snapshot['machines'][name]
+            machine.set_state(state)
+            factory.env.process(machine.run_machine(factory.env, state['resume_phase'], state['remaining_time']))
 
-        # Loop over n stations
-        for n in range(1,6):
+        # Return restored factory
+        return factory
 
-            # Create a new list of process times 
-            PROCESS_TIMES = [10] * 7
+def run_scenario(process_times, file_path, seed=SEED, simulation_time=SIMULATION_TIME):
+    ''' Simulates the factory with the given process times and appends all observations to the result csv.'''
+
+    # Reset seed to default number
+    np.random.seed(seed=seed)
+
+    # Set up factory using the modified process times 
+    factory = Factory_Simulation(process_times)
+
+    # Run all machines
+    for name, machine in factory.all_machines.items(): 
+        # Execute all processing steps
+        factory.env.process(machine.run_machine(factory.env))
+
+    # Save results as csv (writer is much faster than using pandas...)
+    with open(file_path, 'a+', newline='') as result_file:
+        writer_object = writer(result_file)
+
+        # Iter over simulation time 
+        for t in tqdm(range(1, simulation_time)):
+
+            # Reset ITV of all machines (not required for buffer level or machine states)
+            factory.reset_interdeparture_times()
             
-            # Adjust list and set station m and n to bottleneck process times 
-            PROCESS_TIMES[n] = pt_bottleneck
-            PROCESS_TIMES[m] = pt_bottleneck
+            # Run env until t
+            factory.env.run(until=t)
+            
+            # Get observations as list
+            new_line = [t] + factory.get_buffer_level() + factory.get_machine_states() + factory.get_interdeparture_times()
+            # Append list to csv 
+            writer_object.writerow(new_line)
 
-            # Print loop progression 
-            if True:
-                print('({},{})'.format(m,n))
-                print(PROCESS_TIMES)
+def run_from_snapshot(snapshot, simulation_time, process_times=None, seed=None):
+    ''' Continues the snapshot until the given time and returns all observations (same layout as the result csv).'''
 
-            # Reset seed to default number
-            np.random.seed(seed=42)
+    # Restore factory from snapshot
+    factory = Factory_Simulation.from_snapshot(snapshot, process_times, seed)
 
-            # Set up factory using the modified process times 
-            factory = Factory_Simulation(PROCESS_TIMES)
+    # Set up list of observations
+    observations = []
 
-            # Run all machines
-            for name, machine in factory.all_machines.items(): 
-                # Execute all processing steps
-                factory.env.process(machine.run_machine(factory.env))
+    # Iter over remaining simulation time 
+    for t in range(int(snapshot['time']) + 1, simulation_time):
 
-            # Iter over simulation time 
-            for t in tqdm(range(1, SIMULATION_TIME)):
+        # Reset ITV of all machines and run env until t
+        factory.reset_interdeparture_times()
+        factory.env.run(until=t)
 
-                # Reset ITV of all machines (not required for buffer level or machine states)
-                factory.reset_interdeparture_times()
-                
-                # Run env until t
-                factory.env.run(until=t)
-                
-                # Save results as csv (writer is much faster than using pandas...)
-                with open('results_bn-pt_{}/result_25k_bn({},{})_bn-pt({}).csv'.format(pt_bottleneck,m,n,pt_bottleneck), 'a+', newline='') as result_file:
-                    # Get observations as list
-                    new_line = [t] + factory.get_buffer_level() + factory.get_machine_states() + factory.get_interdeparture_times()
-                    # Append list to csv 
-                    writer_object = writer(result_file)
-                    writer_object.writerow(new_line)
-                    result_file.close()
+        # Get observations as list
+        observations += [[t] + factory.get_buffer_level() + factory.get_machine_states() + factory.get_interdeparture_times()]
+
+    # Return all observations
+    return observations
+
+def fork_from_snapshot(snapshot, simulation_time, variants, processes=1):
+    ''' Runs one continuation of the snapshot per variant (dict with optional 'process_times' and 'seed') 
+    and returns their observations. With processes > 1, the variants run in worker processes.'''
+
+    # Set up arguments of all variants
+    arguments = [(snapshot, simulation_time, variant.get('process_times'), variant.get('seed')) for variant in variants]
+
+    # Run all variants in the current process
+    if processes == 1:
+        return [run_from_snapshot(*argument) for argument in arguments]
+
+    # Run all variants in worker processes
+    with Pool(processes) as pool:
+        return pool.starmap(run_from_snapshot, arguments)
+
+if __name__ == '__main__':
+
+    # Group all scenarios by canonical key, since (m, n) and (n, m) result in the same simulation
+    unique_scenarios = get_unique_scenarios(range(11, 21, 1), range(1,6), SEED, **ENGINE_PARAMETERS)
+
+    # Loop over all processing time scenarios
+    for pt_bottleneck in range(11, 21, 1): # from 10% to 100% extra time for bottlenecks
+
+        # Print bottleneck percentage progressions
+        print(datetime.now().strftime("%H:%M:%S")+ ' - Running simulations for {} bottleneck'.format(str(pt_bottleneck-10)+'0%'))
+
+        # Loop over all unique scenarios of the current bottleneck process time
+        for scenario_key, aliases in unique_scenarios.items():
+            if aliases[0][0] != pt_bottleneck:
+                continue
+
+            # Unpack the simulated scenario (all other aliases resolve to its results)
+            _, m, n = aliases[0]
+            
+            # Create a new list of process times with station m and n set to bottleneck process times 
+            PROCESS_TIMES = get_process_times(m, n, pt_bottleneck)
+
+            # Print loop progression 
+            if True:
+                print('({},{})'.format(m,n) + ''.join(' = ({},{})'.format(a_m, a_n) for _, a_m, a_n in aliases[1:]))
+                print(PROCESS_TIMES)
+
+            # Simulate the unique scenario once
+            file_path = get_result_file_path(pt_bottleneck, m, n)
+            run_scenario(PROCESS_TIMES, file_path)
+
+            # Resolve all aliases to the simulated results to keep the file naming of all 25 scenarios
+            for alias_pt, alias_m, alias_n in aliases[1:]:
+                shutil.copyfile(file_path, get_result_file_path(alias_pt, alias_m, alias_n))
@@ -0,0 +1,178 @@
+import numpy as np
+
+from time import perf_counter
+from scipy import stats
+
+##############################
+### Set up basic parameter ###
+
+# Number of grid points of each inverse-CDF lookup table
+TABLE_SIZE = 2**14
+
+# Probability mass cut from each tail of the lookup table (ppf is infinite at 0 and 1 for most families)
+TABLE_TAIL = 1e-7
+
+# Max. allowed deviation between table sampling and exact distribution (sup. distance of both CDFs)
+TABLE_TOLERANCE = 1e-3
+
+# Registry of all distribution families (family name -> constructor of a frozen distribution)
+DISTRIBUTION_FAMILIES = {}
+
+def register_distribution(family):
+    ''' Decorator that registers a constructor of a frozen distribution under the given family name.'''
+
+    def register(constructor):
+        DISTRIBUTION_FAMILIES[family] = constructor
+        return constructor
+
+    return register
+
+# All families describe the multiplier that is applied to the nominal process time of a machine
+
+@register_distribution('normal')
+def normal_distribution(std=0.1):
+    ''' Gaussian variability around the nominal process time (as used in factory_simulation.py).'''
+    return stats.norm(loc=1, scale=std)
+
+@register_distribution('skewnorm')
+def skewnorm_distribution(a=10, loc=1, scale=1):
+    ''' Right-skewed variability of process times (as used in factory_simulation_loop.py).'''
+    return stats.skewnorm(a=a, loc=loc, scale=scale)
+
+@register_distribution('lognormal')
+def lognormal_distribution(sigma=0.25, mean=1):
+    ''' Log-normal variability with the given mean multiplier.'''
+    return stats.lognorm(s=sigma, scale=mean*np.exp(-sigma**2/2))
+
+@register_distribution('empirical')
+def empirical_distribution(measurements, nominal_process_time=1):
+    ''' Variability given by process times measured on the shop floor (relative to the nominal process time).'''
+    return Empirical_Distribution(np.asarray(measurements, dtype=float) / nominal_process_time)
+
+class Empirical_Distribution():
+
+    def __init__(self, measurements):
+        '''Constructor for a distribution of measurements with linear interpolated quantiles.'''
+
+        # Sort all measurements to get the quantile function
+        self.measurements = np.sort(measurements)
+        # Set probabilities of all measurements
+        self.probabilities = np.linspace(0, 1, len(self.measurements))
+
+    def ppf(self, q):
+        ''' Returns the quantiles of the given probabilities.'''
+        return np.interp(q, self.probabilities, self.measurements)
+
+    def cdf(self, x):
+        ''' Returns the cumulative probabilities of the given values.'''
+        return np.interp(x, self.measurements, self.probabilities)
+
+    def mean(self):
+        ''' Returns the mean of the interpolated distribution.'''
+        return np.mean((self.measurements[1:] + self.measurements[:-1]) / 2)
+
+    def var(self):
+        ''' Returns the variance of the interpolated distribution.'''
+        lower, upper = self.measurements[:-1], self.measurements[1:]
+        return np.mean((lower**2 + lower*upper + upper**2) / 3) - self.mean()**2
+
+    def rvs(self, size=1, random_state=None):
+        ''' Returns random samples of the measurements.'''
+        return self.ppf((random_state or np.random).random(size))
+
+class Process_Time_Distribution():
+
+    def __init__(self, family, table_size=TABLE_SIZE, **parameters):
+        '''Constructor for a process time distribution that samples through an inverse-CDF lookup table.'''
+
+        # Set family and parameters of the distribution
+        self.family = family
+        self.parameters = parameters
+
+        # Get exact (frozen) distribution from registry
+        self.distribution = DISTRIBUTION_FAMILIES[family](**parameters)
+
+        # Set up equidistant probability grid (tails are cut since ppf might be infinite)
+        self.quantiles = np.linspace(0, 1, table_size)
+        self.quantiles[0] = TABLE_TAIL
+        self.quantiles[-1] = 1 - TABLE_TAIL
+
+        # Precompute lookup table of the inverse CDF (process times can't be negative)
+        self.table = np.maximum(0, self.distribution.ppf(self.quantiles))
+
+        # Precompute slopes between all grid points for interpolation
+        self.slopes = np.append(np.diff(self.table), 0)
+
+    def get_key(self):
+        ''' Returns a hashable key of the distribution (used to identify unique scenarios).'''
+        return (self.family, tuple(sorted((name, tuple(np.ravel(value))) for name, value in self.parameters.items())))
+
+    def lookup(self, probabilities):
+        ''' Returns the interpolated inverse CDF of the given probabilities.'''
+
+        # Get position of each probability on the equidistant grid (no search required)
+        position = probabilities * (len(self.table) - 1)
+        index = position.astype(np.int64)
+
+        # Interpolate linearly between the two neighbouring grid points
+        return self.table[index] + self.slopes[index] * (position - index)
+
+    def sample(self, size):
+        ''' Returns random multipliers of the nominal process time (vectorized table sampling).'''
+        return self.lookup(np.random.random_sample(size))
+
+def get_distributions_key(distributions):
+    ''' Returns a hashable key for a dict of machine names and their process time distributions.'''
+    return tuple(sorted((name, distribution.get_key()) for name, distribution in distributions.items()))
+
+def check_distribution_table(distribution, test_size=10**6):
+    ''' Returns the max. distance between the CDF of the table sampling and the exact CDF of the
+    distribution (evaluated off-grid, including the cut tails) and whether it is within tolerance.'''
+
+    # Set up fine probability grid between the grid points of the lookup table
+    probabilities = np.linspace(0, 1, test_size, endpoint=False) + 0.5/test_size
+
+    # Get the exact CDF at the values returned by the table lookup
+    exact_probabilities = distribution.distribution.cdf(distribution.lookup(probabilities))
+
+    # Calculate max. distance between both CDFs
+    max_error = np.max(np.abs(exact_probabilities - probabilities))
+
+    # Return error and result of self-check
+    return max_error, max_error <= TABLE_TOLERANCE
+
+if __name__ == '__main__':
+
+    # Set up one example of each registered family
+    examples = [Process_Time_Distribution('normal', std=0.1),
+                Process_Time_Distribution('skewnorm', a=10, loc=1),
+                Process_Time_Distribution('lognormal', sigma=0.25),
+                Process_Time_Distribution('empirical', measurements=np.random.gamma(9, 1.2, size=1000), nominal_process_time=10)]
+
+    # Set sample size for timing
+    sample_size = 10**6
+
+    # Loop over all examples
+    for example in examples:
+
+        # Run self-check of the lookup table
+        max_error, passed = check_distribution_table(example)
+
+        # Measure time of exact sampling
+        start = perf_counter()
+        example.distribution.rvs(size=sample_size)
+        time_exact = perf_counter() - start
+
+        # Measure time of table sampling
+        start = perf_counter()
+        example.sample(sample_size)
+        time_table = perf_counter() - start
+
+        # Measure time of uniform sampling as reference
+        start = perf_counter()
+        np.random.random_sample(sample_size)
+        time_uniform = perf_counter() - start
+
+        # Print results
+        print('{:<10} max. CDF error: {:.2e} ({}) - exact: {:.3f}s, table: {:.3f}s, uniform: {:.3f}s'.format(
+            example.family, max_error, 'passed' if passed else 'FAILED', time_exact, time_table, time_uniform))
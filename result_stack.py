@@ -0,0 +1,195 @@
+import os
+import json
+import warnings
+import numpy as np
+import pandas as pd
+
+from time import perf_counter
+
+import bottleneck_determination_baseline as baseline
+from bottleneck_determination import detect_itv_bottleneck, detect_itv_bottleneck_batch, detect_apm_bottleneck, detect_bnw_bottleneck, calculate_agreement_ratios
+from scenario_canonicalization import get_result_file_path, get_unique_scenarios
+from factory_simulation_loop import BUFFER_CAPACITY, SEED, ENGINE_PARAMETERS
+
+##############################
+### Set up basic parameter ###
+
+# Directory of the typed on-disk stack of all results (one .npy file per attribute, memory mapped on load)
+STACK_DIRECTORY = 'results_stack'
+
+# Data type of each attribute in the stack (interdeparture times stay float64, so the variances are unchanged)
+STACK_DTYPES = {'buffer_levels': np.int32, 'machine_states': np.int8, 'interdeparture_times': np.float64}
+
+# Number of scenarios detected at once (bounds the memory of the temporaries independent of the stack size,
+# larger chunks are not faster since the temporaries no longer fit into the cache)
+CHUNK_SIZE = 4
+
+# Rolling window of the interdeparture time variance
+VARIANCE_INTERVALL = 5000
+
+# Total number of stations
+station_count = 7
+
+# Set column names for all buffer level, machine states and process times
+buffer_level_cols = ['bl_b{i}'.format(i=i) for i in range(station_count+1)]
+machine_state_cols = ['ms_m{i}'.format(i=i+1) for i in range(station_count)]
+process_times_cols = ['pt_m{i}'.format(i=i+1) for i in range(station_count)]
+
+# Column names for import
+column_names = buffer_level_cols + machine_state_cols + process_times_cols
+
+# Columns of each attribute in the stack
+stack_columns = {'buffer_levels': buffer_level_cols, 'machine_states': machine_state_cols, 'interdeparture_times': process_times_cols}
+
+def read_result_csv(file_path):
+    ''' Returns buffer levels, machine states and interdeparture times of a result csv as dict of typed
+    2D arrays (time x station).'''
+
+    # Load data
+    data = pd.read_csv(file_path, names=column_names).reset_index(drop=True)
+
+    # Return typed arrays of all attributes
+    return {attribute: data[cols].to_numpy(dtype=STACK_DTYPES[attribute]) for attribute, cols in stack_columns.items()}
+
+def load_result_stack(file_paths):
+    ''' Returns the results of all given csv files as dict of 3D arrays (scenario x time x station). All
+    scenarios need the same number of observations.'''
+
+    # Set up stack from the first result
+    first_result = read_result_csv(file_paths[0])
+    stack = {attribute: np.empty((len(file_paths),) + values.shape, dtype=values.dtype) for attribute, values in first_result.items()}
+
+    # Fill the stack with all results (one csv in memory at a time)
+    for scenario, file_path in enumerate(file_paths):
+        result = first_result if scenario == 0 else read_result_csv(file_path)
+        for attribute, values in result.items():
+            stack[attribute][scenario] = values
+
+    # Return stack
+    return stack
+
+def get_stack_parameters(seed=SEED, engine_parameters=ENGINE_PARAMETERS):
+    ''' Returns the seed and engine parameters of the stacked simulations in a json compatible form.'''
+    return {'seed': seed, 'engine_parameters': repr(sorted(engine_parameters.items()))}
+
+def save_result_stack(stack, scenarios, directory=STACK_DIRECTORY, seed=SEED, engine_parameters=ENGINE_PARAMETERS):
+    ''' Saves the stack as typed .npy files together with the (bn_pt, m, n) of each scenario and the seed
+    and engine parameters of the simulations.'''
+
+    # Create directory if not exists
+    os.makedirs(directory, exist_ok=True)
+
+    # Save all attributes and scenarios
+    for attribute, values in stack.items():
+        np.save(os.path.join(directory, attribute + '.npy'), values)
+    np.save(os.path.join(directory, 'scenarios.npy'), np.asarray(scenarios, dtype=np.int32))
+    with open(os.path.join(directory, 'parameters.json'), 'w') as parameters_file:
+        json.dump(get_stack_parameters(seed, engine_parameters), parameters_file)
+
+def open_result_stack(directory=STACK_DIRECTORY, seed=SEED, engine_parameters=ENGINE_PARAMETERS):
+    ''' Returns the stack (memory mapped, nothing is read before it is used) and the list of (bn_pt, m, n)
+    of each scenario. Raises a ValueError if the stack was simulated with other parameters.'''
+
+    # Check seed and engine parameters of the stack
+    with open(os.path.join(directory, 'parameters.json')) as parameters_file:
+        if json.load(parameters_file) != get_stack_parameters(seed, engine_parameters):
+            raise ValueError('Stack in {} was simulated with other parameters'.format(directory))
+
+    # Map all attributes
+    stack = {attribute: np.load(os.path.join(directory, attribute + '.npy'), mmap_mode='r') for attribute in STACK_DTYPES}
+
+    # Return stack and scenarios
+    return stack, [tuple(scenario) for scenario in np.load(os.path.join(directory, 'scenarios.npy')).tolist()]
+
+def get_result_stack(scenarios, directory=STACK_DIRECTORY, seed=SEED, engine_parameters=ENGINE_PARAMETERS):
+    ''' Returns the stack and the list of stacked scenarios for the given (bn_pt, m, n). Uses the on-disk
+    stack if it is up to date and covers all scenarios, else stacks the result csvs. Raises a
+    FileNotFoundError if a scenario has no result csv, so no partial results are used.'''
+
+    # Try the on-disk stack
+    if os.path.isdir(directory):
+        try:
+            stack, stacked_scenarios = open_result_stack(directory, seed, engine_parameters)
+            missing_scenarios = [scenario for scenario in scenarios if tuple(scenario) not in set(stacked_scenarios)]
+            if not missing_scenarios:
+                return stack, stacked_scenarios
+            print('Stack in {} misses {} of {} scenarios (e.g. {}), loading the result csvs instead'.format(
+                directory, len(missing_scenarios), len(scenarios), missing_scenarios[0]))
+        except (OSError, ValueError) as error:
+            print('Stack in {} not usable ({}), loading the result csvs instead'.format(directory, error))
+
+    # Check that every scenario has a result csv
+    missing_scenarios = [tuple(scenario) for scenario in scenarios if not os.path.exists(get_result_file_path(*scenario))]
+    if missing_scenarios:
+        raise FileNotFoundError('No result csv for {} of {} scenarios (e.g. {}), run factory_simulation_loop.py first'.format(
+            len(missing_scenarios), len(scenarios), get_result_file_path(*missing_scenarios[0])))
+
+    # Stack the result csvs
+    return load_result_stack([get_result_file_path(*scenario) for scenario in scenarios]), [tuple(scenario) for scenario in scenarios]
+
+def detect_stack_bottlenecks(stack, variance_intervall=VARIANCE_INTERVALL, buffer_capacity=BUFFER_CAPACITY, chunk_size=CHUNK_SIZE):
+    ''' Returns the bottlenecks of all scenarios in the stack as 3D array (scenario x time x method) with
+    the methods in the order itv, apm, bnw (like the columns in bottleneck_detection_comparison.py).'''
+
+    # Set up bottlenecks of all scenarios
+    scenario_count, tick_count, _ = stack['machine_states'].shape
+    bottlenecks = np.empty((scenario_count, tick_count, 3), dtype=np.int8)
+
+    # Loop over all chunks of scenarios (only the current chunk is read from a memory mapped stack)
+    for start in range(0, scenario_count, chunk_size):
+        chunk = slice(start, start + chunk_size)
+
+        # Detect bottlenecks of all scenarios in the chunk with all three methods
+        bottlenecks[chunk, :, 0] = detect_itv_bottleneck_batch(np.asarray(stack['interdeparture_times'][chunk]), variance_intervall)
+        bottlenecks[chunk, :, 1] = detect_apm_bottleneck(np.asarray(stack['machine_states'][chunk]))
+        bottlenecks[chunk, :, 2] = detect_bnw_bottleneck(np.asarray(stack['buffer_levels'][chunk]), buffer_capacity)
+
+    # Return bottlenecks
+    return bottlenecks
+
+if __name__ == '__main__':
+
+    # Get the simulated alias of all unique scenarios with results
+    scenarios = [aliases[0] for aliases in get_unique_scenarios(range(11, 21, 1), range(1, 6), SEED, **ENGINE_PARAMETERS).values()
+                 if os.path.exists(get_result_file_path(*aliases[0]))]
+
+    # Convert all results to the typed stack
+    start = perf_counter()
+    save_result_stack(load_result_stack([get_result_file_path(*scenario) for scenario in scenarios]), scenarios)
+    print('Stacked {} scenarios in {:.1f}s'.format(len(scenarios), perf_counter() - start))
+
+    # Measure batch detection and agreement ratios on the memory mapped stack
+    stack, scenarios = open_result_stack()
+    start = perf_counter()
+    bottlenecks = detect_stack_bottlenecks(stack)
+    ratios = calculate_agreement_ratios(bottlenecks, [[0, 1], [1, 2], [2, 0]])
+    time_batch = perf_counter() - start
+
+    # Measure the array detectors per scenario
+    start = perf_counter()
+    single_bottlenecks = [[detect_itv_bottleneck(stack['interdeparture_times'][scenario], VARIANCE_INTERVALL),
+                           detect_apm_bottleneck(stack['machine_states'][scenario]),
+                           detect_bnw_bottleneck(stack['buffer_levels'][scenario], BUFFER_CAPACITY)] for scenario in range(len(scenarios))]
+    time_single = perf_counter() - start
+
+    # Measure the original DataFrame pipeline of the comparison script per scenario (slow, python loops over all rows)
+    start = perf_counter()
+    original_bottlenecks = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for scenario in range(len(scenarios)):
+            data = pd.DataFrame(np.concatenate([stack[attribute][scenario] for attribute in stack_columns], axis=1), columns=column_names)
+            data = baseline.calculate_itv_bottleneck(df=data, station_count=station_count, variance_intervall=VARIANCE_INTERVALL, append_aux_variables=False)
+            data = baseline.calculate_apm_bottleneck(df=data, station_count=station_count, append_aux_variables=False)
+            data = baseline.calculate_bnw_bottleneck(df=data, station_count=station_count, buffer_capacity=BUFFER_CAPACITY)
+            original_bottlenecks += [data[data.columns[-3:]].to_numpy().T]
+    time_original = perf_counter() - start
+
+    # Check that all give the same bottlenecks
+    for scenario in range(len(scenarios)):
+        assert all(np.array_equal(bottlenecks[scenario, :, method], single_bottlenecks[scenario][method]) for method in range(3)), scenarios[scenario]
+        assert np.array_equal(bottlenecks[scenario].T, original_bottlenecks[scenario]), scenarios[scenario]
+
+    # Print results
+    print('Detected all bottlenecks (identical) - batch with agreement ratios: {:.2f}s, array detectors per scenario: {:.2f}s, original pipeline per scenario: {:.1f}s ({:.0f}x)'.format(
+        time_batch, time_single, time_original, time_original / time_batch))
@@ -0,0 +1,55 @@
+##############################
+### Scenario canonicalization ###
+
+# Scenario (m, n) and scenario (n, m) set the exact same process times and are simulated with the same
+# seed, and the diagonal m == n is a single bottleneck case. Both the simulation sweep and the analysis
+# scripts therefore identify a scenario by its canonical key (process times, seed and engine parameters),
+# so that every unique configuration is simulated and detected only once.
+
+# Number of stations in the simulated line
+STATION_COUNT = 7
+
+# Default process time of all non-bottleneck stations
+DEFAULT_PROCESS_TIME = 10
+
+def get_process_times(m, n, pt_bottleneck, station_count=STATION_COUNT, default_process_time=DEFAULT_PROCESS_TIME):
+    ''' Returns the list of process times for scenario (m, n) with station m and n set to the bottleneck process time.'''
+
+    # Create a new list of process times
+    process_times = [default_process_time] * station_count
+
+    # Adjust list and set station m and n to bottleneck process times
+    process_times[n] = pt_bottleneck
+    process_times[m] = pt_bottleneck
+
+    # Return process times of the scenario
+    return process_times
+
+def get_scenario_key(process_times, seed, **engine_parameters):
+    ''' Returns a hashable key that is identical for all scenarios resulting in the same simulation.'''
+    return (tuple(process_times), seed, tuple(sorted(engine_parameters.items())))
+
+def get_result_file_path(bn_pt, m, n):
+    ''' Returns the file path of the result csv of scenario (m, n) for the given bottleneck process time.'''
+    return 'results_bn-pt_{bn_pt}/result_25k_bn({bn1},{bn2})_bn-pt({bn_pt}).csv'.format(bn1=m, bn2=n, bn_pt=bn_pt)
+
+def get_unique_scenarios(pt_bottlenecks, stations, seed, **engine_parameters):
+    ''' Groups all (bn_pt, m, n) scenarios by their canonical key and returns a dict that maps each key
+    to the list of its aliases. The first alias of each list is the one that gets simulated.'''
+
+    # Create dict for all unique scenarios
+    unique_scenarios = {}
+
+    # Loop over all scenarios in the order of the original sweep
+    for bn_pt in pt_bottlenecks:
+        for m in stations:
+            for n in stations:
+
+                # Get canonical key of the current scenario
+                scenario_key = get_scenario_key(get_process_times(m, n, bn_pt), seed, **engine_parameters)
+
+                # Append scenario to its aliases
+                unique_scenarios.setdefault(scenario_key, []).append((bn_pt, m, n))
+
+    # Return all unique scenarios and their aliases
+    return unique_scenarios
@@ -0,0 +1,85 @@
+import math
+import numpy as np
+
+from multiprocessing import Pool
+
+##############################
+### Set up basic parameter ###
+
+# Number of samples drawn at once (bounds the memory independent of the total sample size)
+CHUNK_SIZE = 10**6
+
+def get_bin_indices(samples, bin_edges):
+    ''' Returns the bin index of each sample (-1 and len(bin_edges)-1 for samples outside the edges).'''
+
+    # Calculate index directly for equidistant bin edges
+    bin_width = bin_edges[1] - bin_edges[0]
+    if np.allclose(np.diff(bin_edges), bin_width):
+        indices = np.floor((samples - bin_edges[0]) / bin_width).astype(np.int64)
+        # Assign samples on the last edge to the last bin (like np.histogram)
+        indices[samples == bin_edges[-1]] = len(bin_edges) - 2
+    # Search bins otherwise
+    else:
+        indices = np.searchsorted(bin_edges, samples, side='right') - 1
+        indices[samples == bin_edges[-1]] = len(bin_edges) - 2
+
+    # Clip all samples outside the edges to the two overflow indices
+    return np.clip(indices, -1, len(bin_edges) - 1)
+
+def accumulate_histogram(distribution, scale, sample_size, bin_edges, chunk_size, seed):
+    ''' Draws sample_size samples in chunks and returns the counts per bin (plus underflow and overflow
+    as first and last entry) and the exactly rounded sum of all samples.'''
+
+    # Set up independent random generator for this share of samples
+    random_state = np.random.default_rng(seed)
+
+    # Set up counts (including underflow and overflow) and partial sums of all chunks
+    counts = np.zeros(len(bin_edges) + 1, dtype=np.int64)
+    partial_sums = []
+
+    # Loop over all chunks
+    for start in range(0, sample_size, chunk_size):
+
+        # Draw next chunk of samples
+        samples = distribution.rvs(size=min(chunk_size, sample_size - start), random_state=random_state) * scale
+
+        # Accumulate counts into the fixed bins (shifted by one for the underflow)
+        counts += np.bincount(get_bin_indices(samples, bin_edges) + 1, minlength=len(counts))
+
+        # Accumulate the exactly rounded sum of the chunk
+        partial_sums += [math.fsum(samples)]
+
+    # Return counts and sum
+    return counts, math.fsum(partial_sums)
+
+def stream_histogram(distribution, scale, sample_size, bin_edges, chunk_size=CHUNK_SIZE, processes=1, seed=None):
+    ''' Returns the histogram counts (within the given bin edges) and the mean of sample_size samples of the
+    distribution multiplied by scale. The samples are drawn in chunks, so memory stays constant, and
+    optionally split across processes (only call with processes > 1 below a __main__ guard, since the
+    spawned worker processes import the calling script).'''
+
+    # Set bin edges as array
+    bin_edges = np.asarray(bin_edges, dtype=float)
+
+    # Split samples into one share per process
+    shares = [sample_size // processes + (1 if i < sample_size % processes else 0) for i in range(processes)]
+    # Spawn independent seeds for all shares
+    seeds = np.random.SeedSequence(seed).spawn(processes)
+
+    # Set up arguments of all shares
+    arguments = [(distribution, scale, share, bin_edges, chunk_size, share_seed) for share, share_seed in zip(shares, seeds)]
+
+    # Accumulate all shares in the current process
+    if processes == 1:
+        results = [accumulate_histogram(*arguments[0])]
+    # Accumulate all shares in parallel
+    else:
+        with Pool(processes) as pool:
+            results = pool.starmap(accumulate_histogram, arguments)
+
+    # Merge counts and sums of all shares
+    counts = np.sum([result[0] for result in results], axis=0)
+    mean = math.fsum(result[1] for result in results) / sample_size
+
+    # Return counts within the bin edges (without underflow and overflow) and mean
+    return counts[1:-1], mean
@@ -0,0 +1,325 @@
+import os
+import glob
+import json
+import time
+import socket
+import shutil
+import argparse
+import threading
+import pandas as pd
+
+from bottleneck_determination import detect_itv_bottleneck, detect_apm_bottleneck, detect_bnw_bottleneck
+from scenario_canonicalization import get_process_times, get_result_file_path, get_unique_scenarios
+from factory_simulation_loop import SIMULATION_TIME, BUFFER_CAPACITY, SEED, ENGINE_PARAMETERS, run_scenario
+
+##############################
+### Set up basic parameter ###
+
+# Number of unique scenarios per shard
+SHARD_SIZE = 5
+
+# Time (in seconds) after which the lock of a worker without heartbeat expires
+LEASE_TIMEOUT = 600
+
+# Rolling window of the interdeparture time variance
+VARIANCE_INTERVALL = 5000
+
+# Total number of stations
+station_count = 7
+
+# Set column names for all buffer level, machine states and process times
+buffer_level_cols = ['bl_b{i}'.format(i=i) for i in range(station_count+1)]
+machine_state_cols = ['ms_m{i}'.format(i=i+1) for i in range(station_count)]
+process_times_cols = ['pt_m{i}'.format(i=i+1) for i in range(station_count)]
+
+# Column names for import
+column_names = buffer_level_cols + machine_state_cols + process_times_cols
+
+# Same pairs of detection methods as in bottleneck_detection_comparison.py (numbers index itv, apm, bnw)
+combination_methods = [['bnw', 'apm'], ['apm', 'itv'], ['itv', 'bnw']]
+combination_numbers = [[0, 1], [1, 2], [2, 0]]
+
+# Work queue layout in the shared directory
+#   queue.json            parameters of the sweep
+#   shards/<shard>.json   unique scenarios (and their aliases) of each shard
+#   locks/<shard>.lock    lock of the worker processing the shard (mtime is the heartbeat)
+#   locks/<shard>.lock.takeover  guard of the worker taking over an expired lock
+#   summaries/<shard>.csv detection summary of each finished shard (marks the shard as done)
+
+def init_queue(queue_dir, pt_bottlenecks, shard_size=SHARD_SIZE, simulation_time=SIMULATION_TIME, results_dir='.'):
+    ''' Splits all unique scenarios of the sweep into shards and writes them to the queue directory.'''
+
+    # Create directories of the queue
+    for directory in ['shards', 'locks', 'summaries']:
+        os.makedirs(os.path.join(queue_dir, directory), exist_ok=True)
+
+    # Save parameters of the sweep
+    with open(os.path.join(queue_dir, 'queue.json'), 'w') as queue_file:
+        json.dump({'simulation_time': simulation_time, 'results_dir': results_dir}, queue_file)
+
+    # Get all unique scenarios with their aliases (simulation time is part of the canonical key)
+    engine_parameters = dict(ENGINE_PARAMETERS, simulation_time=simulation_time)
+    aliases = list(get_unique_scenarios(pt_bottlenecks, range(1,6), SEED, **engine_parameters).values())
+
+    # Write one file per shard
+    for number, start in enumerate(range(0, len(aliases), shard_size)):
+        with open(os.path.join(queue_dir, 'shards', 'shard_{:04d}.json'.format(number)), 'w') as shard_file:
+            json.dump(aliases[start:start+shard_size], shard_file)
+
+    # Return number of shards
+    return number + 1
+
+def claim_shard(queue_dir, shard, worker_id, lease_timeout=LEASE_TIMEOUT):
+    ''' Tries to claim a shard by atomically creating its lock file (expired locks are taken over).
+    Returns True if the worker now holds the lock.'''
+
+    # Get path of the lock file
+    lock_path = os.path.join(queue_dir, 'locks', shard + '.lock')
+
+    # Take over an expired lock
+    try:
+        if time.time() - os.path.getmtime(lock_path) > lease_timeout and not take_over_lock(lock_path, lease_timeout):
+            return False
+    except FileNotFoundError:
+        pass
+
+    # Create lock file (fails if another worker holds the lock)
+    try:
+        lock_file = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    # Write worker id to the lock file
+    os.write(lock_file, worker_id.encode())
+    os.close(lock_file)
+    return True
+
+def take_over_lock(lock_path, lease_timeout=LEASE_TIMEOUT):
+    ''' Removes an expired lock file while holding the takeover guard of the lock, so only one worker
+    can remove it. The expiry is checked again under the guard, so a fresh lock of a worker that just
+    took over is never removed. Returns False if another worker holds the guard.'''
+
+    # Get path of the takeover guard
+    guard_path = lock_path + '.takeover'
+
+    # Create takeover guard (fails if another worker is taking over the lock)
+    try:
+        guard_file = os.open(guard_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # Remove guards left by workers that died during a takeover (a takeover only takes milliseconds)
+        try:
+            if time.time() - os.path.getmtime(guard_path) > lease_timeout:
+                os.remove(guard_path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    # Remove the lock only if it is still expired, and release the guard in any case
+    try:
+        if time.time() - os.path.getmtime(lock_path) > lease_timeout:
+            os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+    finally:
+        os.close(guard_file)
+        os.remove(guard_path)
+    return True
+
+def holds_lock(queue_dir, shard, worker_id):
+    ''' Returns True if the lock file of the shard still belongs to the worker.'''
+    try:
+        with open(os.path.join(queue_dir, 'locks', shard + '.lock')) as lock_file:
+            return lock_file.read() == worker_id
+    except FileNotFoundError:
+        return False
+
+def release_lock(queue_dir, shard, worker_id):
+    ''' Removes the lock file of the shard if it still belongs to the worker.'''
+    if holds_lock(queue_dir, shard, worker_id):
+        os.remove(os.path.join(queue_dir, 'locks', shard + '.lock'))
+
+def keep_lease(queue_dir, shard, worker_id, stop_event, lease_timeout=LEASE_TIMEOUT):
+    ''' Updates the mtime of the lock file as heartbeat until the stop event is set.'''
+    while not stop_event.wait(lease_timeout / 3):
+        if holds_lock(queue_dir, shard, worker_id):
+            os.utime(os.path.join(queue_dir, 'locks', shard + '.lock'))
+
+def summarize_scenario(file_path, aliases):
+    ''' Detects the bottlenecks of one result csv and returns the agreement ratios for all its aliases.'''
+
+    # Load data
+    data = pd.read_csv(file_path, names=column_names).reset_index(drop=True)
+
+    # Calculate the bottleneck stations with all three detection methods
+    bottlenecks = [detect_itv_bottleneck(data[process_times_cols].to_numpy(), VARIANCE_INTERVALL),
+                   detect_apm_bottleneck(data[machine_state_cols].to_numpy()),
+                   detect_bnw_bottleneck(data[buffer_level_cols].to_numpy(), BUFFER_CAPACITY)]
+
+    # Set up list of result dicts
+    summary = []
+
+    # Loop over all aliases and the three possible combinations
+    for bn_pt, m, n in aliases:
+        for (met1, met2), (num1, num2) in zip(combination_methods, combination_numbers):
+
+            # Calculate ratio of agreement on detected bottleneck stations
+            ratio = (bottlenecks[num1] == bottlenecks[num2]).mean()
+            summary += [{'bn_pt': bn_pt, 'm': m, 'n': n, 'method_1': met1, 'method_2': met2, 'ratio': ratio}]
+
+    # Return summary of all aliases
+    return summary
+
+def process_shard(queue_dir, shard, worker_id, simulation_time, results_dir):
+    ''' Simulates all unique scenarios of a shard, resolves their aliases and writes the detection summary.
+    Returns False if the lock was lost to another worker in the meantime.'''
+
+    # Load unique scenarios of the shard
+    with open(os.path.join(queue_dir, 'shards', shard + '.json')) as shard_file:
+        all_aliases = json.load(shard_file)
+
+    # Set up summary of the shard
+    summary = []
+
+    # Loop over all unique scenarios
+    for aliases in all_aliases:
+
+        # Stop if another worker took over the expired lock
+        if not holds_lock(queue_dir, shard, worker_id):
+            return False
+
+        # Get result file of the simulated scenario
+        bn_pt, m, n = aliases[0]
+        file_path = os.path.join(results_dir, get_result_file_path(bn_pt, m, n))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        # Simulate into a worker-specific file and move it into place once complete
+        partial_path = '{}.partial-{}'.format(file_path, worker_id)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        run_scenario(get_process_times(m, n, bn_pt), partial_path, SEED, simulation_time)
+        os.replace(partial_path, file_path)
+
+        # Resolve all aliases to the simulated results (copied to a worker-specific file first as well)
+        for alias_pt, alias_m, alias_n in aliases[1:]:
+            alias_path = os.path.join(results_dir, get_result_file_path(alias_pt, alias_m, alias_n))
+            shutil.copyfile(file_path, '{}.partial-{}'.format(alias_path, worker_id))
+            os.replace('{}.partial-{}'.format(alias_path, worker_id), alias_path)
+
+        # Add detection summary of all aliases
+        summary += summarize_scenario(file_path, [tuple(alias) for alias in aliases])
+
+    # Write summary to a temporary file
+    summary_path = os.path.join(queue_dir, 'summaries', shard + '.csv')
+    pd.DataFrame(summary).to_csv(summary_path + '.partial-' + worker_id, index=False)
+
+    # Discard summary if another worker took over the expired lock in the meantime
+    if not holds_lock(queue_dir, shard, worker_id):
+        os.remove(summary_path + '.partial-' + worker_id)
+        return False
+
+    # Move summary into place (marks the shard as done)
+    os.replace(summary_path + '.partial-' + worker_id, summary_path)
+    return True
+
+def run_worker(queue_dir, worker_id=None, lease_timeout=LEASE_TIMEOUT):
+    ''' Claims and processes shards until all shards are done. Returns the number of processed shards.'''
+
+    # Use host name and process id as default worker id
+    worker_id = worker_id or '{}-{}'.format(socket.gethostname(), os.getpid())
+
+    # Load parameters of the sweep
+    with open(os.path.join(queue_dir, 'queue.json')) as queue_file:
+        parameters = json.load(queue_file)
+
+    # Count processed shards
+    processed_shards = 0
+
+    while True:
+
+        # Get all shards that are not done yet
+        shards = [os.path.basename(path)[:-5] for path in sorted(glob.glob(os.path.join(queue_dir, 'shards', '*.json')))]
+        open_shards = [shard for shard in shards if not os.path.exists(os.path.join(queue_dir, 'summaries', shard + '.csv'))]
+
+        # Stop once all shards are done
+        if not open_shards:
+            return processed_shards
+
+        # Try to claim one of the open shards
+        claimed_shard = next((shard for shard in open_shards if claim_shard(queue_dir, shard, worker_id, lease_timeout)), None)
+
+        # Wait for other workers (their locks might expire)
+        if claimed_shard is None:
+            time.sleep(min(lease_timeout / 3, 10))
+            continue
+
+        # Skip shards that were finished by another worker in the meantime
+        if os.path.exists(os.path.join(queue_dir, 'summaries', claimed_shard + '.csv')):
+            release_lock(queue_dir, claimed_shard, worker_id)
+            continue
+
+        # Keep the lease alive while processing
+        print('{} - {} processing {}'.format(time.strftime('%H:%M:%S'), worker_id, claimed_shard))
+        stop_event = threading.Event()
+        heartbeat = threading.Thread(target=keep_lease, args=(queue_dir, claimed_shard, worker_id, stop_event, lease_timeout), daemon=True)
+        heartbeat.start()
+
+        # Process shard and release the lock
+        try:
+            if process_shard(queue_dir, claimed_shard, worker_id, parameters['simulation_time'], parameters['results_dir']):
+                processed_shards += 1
+                release_lock(queue_dir, claimed_shard, worker_id)
+        finally:
+            stop_event.set()
+            heartbeat.join()
+
+def merge_queue(queue_dir, output_dir='.'):
+    ''' Merges the summaries of all shards into the comparison tables (per scenario and grouped, TABLE 1).'''
+
+    # Check that all shards are done
+    shards = [os.path.basename(path)[:-5] for path in sorted(glob.glob(os.path.join(queue_dir, 'shards', '*.json')))]
+    open_shards = [shard for shard in shards if not os.path.exists(os.path.join(queue_dir, 'summaries', shard + '.csv'))]
+    if open_shards:
+        raise RuntimeError('Shards not done yet: ' + ', '.join(open_shards))
+
+    # Load and sort all summaries in the order of the comparison script
+    df_comp = pd.concat([pd.read_csv(os.path.join(queue_dir, 'summaries', shard + '.csv')) for shard in shards], ignore_index=True)
+    df_comp['combination'] = df_comp['method_1'].map({methods[0]: number for number, methods in enumerate(combination_methods)})
+    df_comp = df_comp.sort_values(['bn_pt', 'm', 'n', 'combination']).drop(columns='combination').reset_index(drop=True)
+
+    # Group and calcuate average ratios (TABLE 1)
+    df_grouped = df_comp.groupby(['bn_pt', 'method_1', 'method_2'])['ratio'].mean().reset_index()
+
+    # Save both tables
+    df_comp.to_csv(os.path.join(output_dir, 'results_of_method_comparison.csv'))
+    df_grouped.to_csv(os.path.join(output_dir, 'results_of_method_comparison_grouped.csv'))
+
+    # Return both tables
+    return df_comp, df_grouped
+
+if __name__ == '__main__':
+
+    # Parse command and parameters
+    parser = argparse.ArgumentParser(description='Shard the simulation sweep and comparison over a shared directory.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_init = subparsers.add_parser('init', help='split all unique scenarios into shards')
+    parser_init.add_argument('queue_dir')
+    parser_init.add_argument('--bn-pt', type=int, nargs='+', default=list(range(11, 21, 1)), help='bottleneck process times')
+    parser_init.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser_init.add_argument('--simulation-time', type=int, default=SIMULATION_TIME)
+    parser_init.add_argument('--results-dir', default='.', help='shared directory for the result csvs')
+    parser_work = subparsers.add_parser('work', help='claim and process shards until all are done')
+    parser_work.add_argument('queue_dir')
+    parser_work.add_argument('--worker-id', default=None)
+    parser_work.add_argument('--lease-timeout', type=float, default=LEASE_TIMEOUT)
+    parser_merge = subparsers.add_parser('merge', help='merge all shard summaries into the comparison tables')
+    parser_merge.add_argument('queue_dir')
+    parser_merge.add_argument('--output-dir', default='.')
+    arguments = parser.parse_args()
+
+    # Run command
+    if arguments.command == 'init':
+        print('{} shards created'.format(init_queue(arguments.queue_dir, arguments.bn_pt, arguments.shard_size, arguments.simulation_time, arguments.results_dir)))
+    elif arguments.command == 'work':
+        print('{} shards processed'.format(run_worker(arguments.queue_dir, arguments.worker_id, arguments.lease_timeout)))
+    elif arguments.command == 'merge':
+        print(merge_queue(arguments.queue_dir, arguments.output_dir)[1])